@@ -0,0 +1,210 @@
+# Import necessary libraries
+import asyncio  # For the upstream semaphores and retry delays
+import contextlib  # For the upstream slot context manager
+import logging  # For reporting retries and shed load
+import os  # For interacting with the operating system
+import random  # For jittering retry delays
+import threading  # For guarding the client buckets
+import time  # For refilling the token buckets
+from collections import OrderedDict  # For the LRU of client buckets
+from metrics import count_event, stage_seconds  # For counting shed load and timing the wait for a slot
+
+
+# Logger of this module
+logger = logging.getLogger(__name__)
+
+
+# Raised when a request is shed instead of queued: too many waiting for an upstream slot, or waited too long
+class Overloaded(Exception):
+    pass
+
+
+# Raised when an upstream call still fails with a retryable error after the last attempt
+class UpstreamUnavailable(Exception):
+    pass
+
+
+# Token bucket: 'burst' requests at once, refilled at 'rate' requests per second
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+
+    # Function to take a token, returning 0 when granted or the seconds until one is available
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens = self.tokens - 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+# Per-client rate limit: one token bucket per client key (IP address or session), least recently seen dropped first
+class ClientRateLimiter:
+    """
+    Settings come from the constructor or from RATE_LIMIT_PER_MINUTE (chat turns per client per minute, default 20,
+    0 to disable), RATE_LIMIT_BURST (turns a client may send at once, default 5) and RATE_LIMIT_KEY ("ip" or
+    "session", what a client is, default "ip"). At most 'max_clients' buckets are kept; a dropped bucket starts full
+    again, which only ever errs on the side of the client.
+    """
+
+    def __init__(self, per_minute = None, burst = None, key = None, max_clients = 10000):
+        self.rate = float(per_minute if per_minute is not None else os.getenv("RATE_LIMIT_PER_MINUTE", "20")) / 60
+        self.burst = int(burst if burst is not None else os.getenv("RATE_LIMIT_BURST", "5"))
+        self.key = (key or os.getenv("RATE_LIMIT_KEY", "ip")).strip().lower()
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()  # Client key -> TokenBucket, least recently seen first
+        self.lock = threading.Lock()
+
+
+    # Function to pick the key of a client from its IP address and session id, following RATE_LIMIT_KEY
+    def client_key(self, ip, session = None):
+        return f"session:{session}" if self.key == "session" and session else f"ip:{ip}"
+
+
+    # Function to admit a request from a client, returning 0 when admitted or the seconds it should wait before retrying
+    def check(self, client):
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                bucket = self.buckets[client] = TokenBucket(self.rate, self.burst)
+                while len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last = False)
+            self.buckets.move_to_end(client)
+            wait = bucket.take()
+        if wait:
+            count_event("rate_limited")
+        return wait
+
+
+# Bounds the concurrent upstream LLM calls of one budget (e.g. chat or evaluation) and sheds load beyond a queue bound
+class UpstreamLimiter:
+    def __init__(self, name, limit, max_waiting, queue_timeout):
+        self.name = name
+        self.limit = limit  # Calls in flight at most
+        self.max_waiting = max_waiting  # Calls waiting for a slot at most; more are shed straight away
+        self.queue_timeout = queue_timeout  # Seconds a call may wait for a slot before it is shed
+        self.semaphore = None  # Created on first use, on the event loop that uses it
+        self.waiting = 0
+
+
+    # Context manager holding one slot for the duration of an upstream call (raises Overloaded instead of queueing too long)
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+        if self.semaphore.locked() and self.waiting >= self.max_waiting:
+            count_event("shed", budget = self.name, reason = "queue_full")
+            raise Overloaded(f"{self.waiting} calls already waiting for a {self.name} slot")
+
+        start = time.perf_counter()
+        self.waiting = self.waiting + 1
+        try:
+            if self.semaphore.locked():
+                await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+            else:
+                await self.semaphore.acquire()  # A free slot, no need for a timeout
+        except asyncio.TimeoutError:
+            count_event("shed", budget = self.name, reason = "queue_timeout")
+            raise Overloaded(f"No {self.name} slot within {self.queue_timeout}s")
+        finally:
+            self.waiting = self.waiting - 1
+        stage_seconds.observe(time.perf_counter() - start, stage = f"{self.name}_queue")
+
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+
+# The upstream budgets of the process, shared by every persona
+_upstream_limiters = {}
+_upstream_limiters_lock = threading.Lock()
+
+
+# Function to get the limiter of an upstream budget ("chat" or "evaluation")
+def get_upstream_limiter(budget):
+    """
+    UPSTREAM_CHAT_CONCURRENCY (default 64) and UPSTREAM_EVALUATION_CONCURRENCY (default 16) bound the calls in flight
+    per budget, so evaluations can never take the slots the visitors' replies need. UPSTREAM_MAX_WAITING (default 256)
+    and UPSTREAM_QUEUE_TIMEOUT (seconds, default 10) bound the queue in front of each budget.
+    """
+    with _upstream_limiters_lock:
+        limiter = _upstream_limiters.get(budget)
+        if limiter is None:
+            limiter = _upstream_limiters[budget] = UpstreamLimiter(
+                budget,
+                limit = int(os.getenv(f"UPSTREAM_{budget.upper()}_CONCURRENCY", "64" if budget == "chat" else "16")),
+                max_waiting = int(os.getenv("UPSTREAM_MAX_WAITING", "256")),
+                queue_timeout = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "10")),
+            )
+        return limiter
+
+
+# Function to tell whether an upstream error is worth retrying: rate limits, server errors, timeouts and lost connections
+def is_retryable(error):
+    import openai  # Already loaded by whoever made the call
+    if isinstance(error, openai.APIConnectionError):  # Includes timeouts
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+
+# Function to get the delay the upstream asked for in its Retry-After headers, in seconds, or None
+def retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = response.headers.get(header)
+        if value is not None:
+            try:
+                return max(0.0, float(value) * scale)
+            except ValueError:
+                continue  # An HTTP date, fall back to the backoff
+    return None
+
+
+# Function to await an upstream call, retrying retryable failures with jittered exponential backoff or the Retry-After delay
+async def call_with_retries(call, max_retries = None, base_delay = None, max_delay = 20.0):
+    """
+    'call' is a coroutine function making one attempt. UPSTREAM_MAX_RETRIES (default 3) and UPSTREAM_RETRY_BASE
+    (seconds, default 0.5) set the retry budget and the first backoff. The caller's upstream slot is kept while
+    waiting, so a burst of 429s also lowers the number of calls in flight instead of retrying them all at once.
+    """
+    max_retries = int(max_retries if max_retries is not None else os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+    base_delay = float(base_delay if base_delay is not None else os.getenv("UPSTREAM_RETRY_BASE", "0.5"))
+    for attempt in range(max_retries + 1):
+        try:
+            return await call()
+        except Exception as error:
+            if not is_retryable(error):
+                raise
+            if attempt == max_retries:
+                count_event("upstream_gave_up")
+                raise UpstreamUnavailable(f"Upstream call failed after {attempt + 1} attempts") from error
+            delay = retry_after(error)
+            if delay is None:
+                delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+            count_event("upstream_retry", status = getattr(error, "status_code", None) or type(error).__name__)
+            logger.warning("Upstream call failed -> %r, retrying in %.2fs (attempt %s)", error, delay, attempt + 1)
+            await asyncio.sleep(min(delay, max_delay))
+
+
+# One client rate limiter per process, shared by the front ends
+_client_rate_limiter = None
+
+
+# Function to get the process-wide client rate limiter
+def get_client_rate_limiter():
+    global _client_rate_limiter
+    if _client_rate_limiter is None:
+        _client_rate_limiter = ClientRateLimiter()
+    return _client_rate_limiter
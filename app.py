@@ -1,17 +1,68 @@
 # Import necessary libraries
 from dotenv import load_dotenv  # For loading environment variables from a .env file
-from openai import OpenAI  # For interacting with OpenAI services
-import json  # For handling JSON data
+import asyncio  # For running tool calls and evaluations alongside the conversation
+import functools  # For binding the arguments of an upstream call that may be retried
+import hashlib  # For versioning cached replies by the profile they were generated from
+import logging  # For the debug output of each turn
+import sys  # For estimating the memory held by a persona
+import time  # For timing chat turns
 import os  # For interacting with the operating system
-from pydantic import BaseModel, Field
-import requests  # For making HTTP requests
-from pypdf import PdfReader  # For reading PDF files
-import gradio as gr  # For querying JSON data using JMESPath syntax
+from pydantic import BaseModel, Field, ValidationError
 from string import Template  # For creating string templates with placeholders
+from retrieval import Chunk, ProfileRetriever  # For sending only the relevant parts of the profile
+from profile_cache import default_cache_path, load_profile  # For loading the extracted profile from its on-disk cache
+from notifications import get_notification_dispatcher  # For sending push notifications in the background
+from lead_store import get_lead_store  # For keeping leads and unknown questions, deduplicated
+from tool_registry import ToolRegistry  # For validating and running the tools the LLM calls
+from evaluation import EvaluationPolicy, UnreadableEvaluation  # For deciding whether, when and how replies are evaluated
+from response_cache import ResponseCache, is_history_independent  # For answering repeated questions without the LLM
+from history import HistoryManager, format_transcript  # For keeping long conversations within a token budget
+from admission import Overloaded, UpstreamUnavailable, call_with_retries, get_upstream_limiter  # For bounding and retrying upstream calls
+from personas import PersonaRegistry  # For serving several personas from one process
+from metrics import StageTimer, record_stage, count_event, first_token_seconds, turn_iterations  # For latency and token metrics
 
 # Load environment variables from a .env file
 load_dotenv(override = True)  # This loads the variables defined in the .env file into the environment
 
+
+# Logger of this module; the per-turn details are logged at DEBUG level
+logger = logging.getLogger(__name__)
+
+
+# Function to read a boolean switch from the environment (e.g. CHAT_STREAM=false)
+def env_flag(name, default):
+    value = os.getenv(name)  # Read the raw value of the environment variable
+    if value is None:  # Fall back to the default when the variable is not set
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")  # Treat the usual truthy spellings as enabled
+
+
+# One AsyncOpenAI client per process, created on first use and shared by every conversation
+_openai_client = None
+
+
+# Function to get the process-wide AsyncOpenAI client backed by a single pooled HTTP client
+def get_openai_client():
+    """
+    Every conversation is a coroutine on the same event loop, so they can all share one client and its keep-alive
+    connections instead of opening a client (and a TLS handshake) per conversation. The pool size bounds the number of
+    in-flight upstream requests; requests above it wait for a free connection instead of failing.
+    """
+    global _openai_client
+    if _openai_client is None:
+        # Imported on first use, so that importing this module (e.g. by the headless server) stays cheap
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient  # For interacting with OpenAI services without blocking
+        import httpx  # For sizing the connection pool shared by every conversation
+        
+        limits = httpx.Limits(
+            max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "200")),  # Upper bound on concurrent upstream requests
+            max_keepalive_connections = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "50")),  # Idle connections kept warm
+        )
+        # Retries are made by call_with_retries, which honors Retry-After while holding the caller's upstream slot
+        _openai_client = AsyncOpenAI(http_client = DefaultAsyncHttpxClient(limits = limits), max_retries = 0,
+                                     timeout = float(os.getenv("OPENAI_TIMEOUT", "60")))
+    return _openai_client
+
 # JSON structure for the record_user_details function
 record_user_details_json = {
     "name" : "record_user_details",  # The name of the function being called
@@ -78,17 +129,14 @@ record_unknown_question_json = {
 }
 
 
-# List of tools to be passed to the LLM
-tools = [
-    {
-        "type" : "function",  # Specifies that this entry is a function tool
-        "function" : record_user_details_json  # The JSON structure for the record_user_details function
-    }, 
-    {
-        "type" : "function",  # Specifies that this entry is a function tool
-        "function":  record_unknown_question_json  # The JSON structure for the record_unknown_question function
-    }
-]
+# Registry of the tools available to the LLM, implemented by the methods of the same name on Me
+tool_registry = ToolRegistry()
+tool_registry.register(record_user_details_json)  # The JSON structure for the record_user_details function
+tool_registry.register(record_unknown_question_json)  # The JSON structure for the record_unknown_question function
+
+
+# List of tools to be passed to the LLM, built once from the registry
+tools = tool_registry.definitions
 
 
 system_prompt = """
@@ -141,12 +189,7 @@ With this context, please evaluate the latest response, replying with whether th
 4. **Use Provided Context**: Utilize the summary and LinkedIn profile to inform your responses and provide relevant information.
 5. **Engage with Users**: Encourage further questions and maintain an engaging conversation.
 6. **Respect User Queries**: Treat all user inquiries with respect and provide thoughtful responses.
-7. **JSON Format**: Response must be in JSON format with strict adherence to the provided output schema.
-8. **Enclose JSON**: Enclose JSON response with ```json on its own line, and close it with triple backticks on a new line.
-9. **Markdown Formatting**: Values for each JSON key **should use** `markdown` formatting, including emphasis, italics, lists etc.
-
-## Output Schema:
-${json_schema}
+${output_format}
 
 # Additional Notes:
 - Ensure that the evaluation reflects the quality of the Agent's response in relation to the provided context.
@@ -154,6 +197,19 @@ ${json_schema}
 """
 
 
+# Define the output guidelines of the evaluator when its reply is constrained to the schema by the API ("schema" output)
+evaluator_schema_output_prompt = """7. **Terse Feedback**: Keep the feedback to one short plain-text sentence saying what to fix, and leave it empty when the response is acceptable."""
+
+
+# Define the output guidelines of the evaluator when it has to format its JSON reply itself ("fenced" output)
+evaluator_fenced_output_prompt = """7. **JSON Format**: Response must be in JSON format with strict adherence to the provided output schema.
+8. **Enclose JSON**: Enclose JSON response with ```json on its own line, and close it with triple backticks on a new line.
+9. **Markdown Formatting**: Values for each JSON key **should use** `markdown` formatting, including emphasis, italics, lists etc.
+
+## Output Schema:
+${json_schema}"""
+
+
 # Define the evaluator user prompt for assessing the latest response in a conversation:
 evaluator_user_prompt = """Here's the conversation between the User and the Agent:
 ${history}
@@ -164,6 +220,62 @@ ${reply}
 Please evaluate the response, replying with whether it is acceptable and your feedback.
 """
 
+
+# Define the feedback message sent after a rejected reply; it follows the unchanged system prompt and history,
+# so the prompt prefix shared with the original turn stays cacheable upstream
+rejection_prompt = """## Previous answer rejected
+You just tried to reply (your attempted answer is the previous assistant message), but the quality control rejected your reply.
+## Reason for rejection :
+${feedback}
+
+Please reply to the user's latest message again, taking this feedback into account.
+"""
+
+
+# Define the message carrying the profile excerpts retrieved for the latest user message
+profile_excerpts_prompt = """## Relevant Profile Excerpts
+These are the parts of ${name}'s summary and LinkedIn profile that are relevant to the latest message. Treat them as the provided context.
+
+${excerpts}
+"""
+
+
+# Define the message that stands in for the older turns of a long conversation
+conversation_summary_prompt = """## Summary of the earlier conversation
+The conversation started before the messages below. This is a summary of what was said:
+${summary}
+"""
+
+
+# Define the prompt used to fold older turns of a long conversation into a rolling summary
+history_summary_prompt = """You are summarizing the older part of a conversation between a User and an Agent that represents ${name} on their website.
+Write a concise summary (at most 150 words) that keeps what later replies may need: the questions the User asked, the facts the Agent gave, and any name, email, mobile number or other details the User shared.
+
+## Summary so far:
+${previous_summary}
+
+## Messages to add to the summary:
+${transcript}
+"""
+
+
+# Placeholder used for the summary and LinkedIn sections of the system prompts when excerpts are sent per message instead
+retrieved_profile_note = "Provided as 'Relevant Profile Excerpts' alongside each message."
+
+# Reply given when a turn is shed because the service is overloaded
+busy_reply = "I'm receiving a lot of questions right now and couldn't answer this one. Please try again in a moment."
+
+# Reply given to a visitor who is over their rate limit
+rate_limited_template = Template("You're sending messages faster than I can answer them. Please wait ${seconds} seconds and try again.")
+
+
+# Templates are parsed once at import time instead of on every turn
+evaluator_user_template = Template(evaluator_user_prompt)
+rejection_template = Template(rejection_prompt)
+profile_excerpts_template = Template(profile_excerpts_prompt)
+conversation_summary_template = Template(conversation_summary_prompt)
+history_summary_template = Template(history_summary_prompt)
+
 # Define the Evaluation model to assess the quality of LLM responses
 class Evaluation(BaseModel):
     is_acceptable : bool = Field(..., description = "Indicates if the response is of acceptable quality.")
@@ -179,65 +291,205 @@ class BaseArbitraryModel(BaseModel):
 # Generate the JSON schema for the Evaluation model
 evaluation_json_schema = Evaluation.model_json_schema()
 
+# Response format constraining the evaluator's reply to the Evaluation schema ("schema" output)
+evaluation_response_format = {
+    "type" : "json_schema",
+    "json_schema" : {"name" : "evaluation", "strict" : True, "schema" : {**evaluation_json_schema, "additionalProperties" : False}},
+}
+
+# Output guidelines of the evaluator system prompt per evaluation output
+evaluator_output_prompts = {
+    "schema" : evaluator_schema_output_prompt,
+    "fenced" : Template(evaluator_fenced_output_prompt).substitute(json_schema = evaluation_json_schema),
+}
 
-class Me:
 
-    def __init__(self, name, linkedIn_path, summary_path):
-        self.openai = OpenAI()
+# Holds the system messages of one profile, rendered once and reused by every turn of every conversation
+class PromptContext:
+    """
+    The profile text is tens of kilobytes, so splicing it into the templates on each call costs an allocation of that
+    size per turn. Rendering once also keeps the leading system message byte-identical across turns, which is what the
+    provider's prompt-prefix cache keys on. Messages built from here must only append after these prefixes.
+    """
+    
+    def __init__(self, name, summary, linkedin, evaluation_output = "schema"):
         self.name = name
+        output_format = evaluator_output_prompts[evaluation_output]  # How the evaluator is told to format its verdict
+        
+        # System message for the conversation itself, with the full profile
+        self.chat_system_message = {
+            "role" : "system",  # Role of the message sender, indicating this is a system message
+            "content" : Template(system_prompt).substitute(
+                name = name,  # Substitute the user's name into the system prompt
+                linkedin = linkedin,  # Substitute the LinkedIn profile text into the system prompt
+                summary = summary  # Substitute the summary text into the system prompt
+            ),
+        }
+        
+        # System message for the evaluator, with the full profile
+        self.evaluator_system_message = {
+            "role" : "system",  # Role of the message sender
+            "content" : Template(evaluator_system_prompt).substitute(
+                name = name,  # Substitute the user's name
+                linkedin = linkedin,  # Substitute the LinkedIn profile
+                summary = summary,  # Substitute the summary
+                output_format = output_format,  # Substitute the output guidelines
+            ),
+        }
+        
+        # The same two system messages without the profile, used when relevant excerpts are sent with each message
+        self.chat_instructions_message = {
+            "role" : "system",
+            "content" : Template(system_prompt).substitute(name = name, linkedin = retrieved_profile_note, summary = retrieved_profile_note),
+        }
+        self.evaluator_instructions_message = {
+            "role" : "system",
+            "content" : Template(evaluator_system_prompt).substitute(name = name, linkedin = retrieved_profile_note, summary = retrieved_profile_note,
+                                                                     output_format = output_format),
+        }
+    
+    
+    # Function to wrap retrieved excerpts into the system message that precedes the latest user message
+    def excerpts_message(self, excerpts):
+        return {"role" : "system", "content" : profile_excerpts_template.substitute(name = self.name, excerpts = excerpts)}
+    
+    
+    # Function to build the messages of a chat turn, with either the retrieved excerpts or the full profile
+    def chat_messages(self, message, history, excerpts = None, summary = None):
+        """
+        'history' is the recent part of the conversation and 'summary' the summary of the turns before it, if any.
+        The summary follows the system prompt, as it changes only when more turns are folded into it.
+        """
+        summary_messages = [] if summary is None else [{"role" : "system", "content" : conversation_summary_template.substitute(summary = summary)}]
+        if excerpts is None:
+            return (
+                [self.chat_system_message]  # Pre-rendered system prompt, a stable prefix for every turn
+                + summary_messages  # Summary of the older turns of a long conversation
+                + history  # Include the previous chat history to maintain context
+                + [{"role" : "user", "content" : message}]  # Add the current user message to the messages list
+            )
+        return (
+            [self.chat_instructions_message]  # Stable prefix without the profile
+            + summary_messages  # Summary of the older turns of a long conversation
+            + history  # Include the previous chat history to maintain context
+            + [self.excerpts_message(excerpts), {"role" : "user", "content" : message}]  # Per-message excerpts, then the message
+        )
+
+
+# Holds one completion as it is assembled: the reply text, the tool calls requested, the finish reason and token usage
+class CompletionResult:
+    def __init__(self):
+        self.reply = ""  # Content of the assistant message
+        self.tool_calls = []  # Tool calls in the API's dictionary format
+        self.finish_reason = None  # "stop", "tool_calls", "length", ...
+        self.usage = None  # Token usage reported by the API, if any
 
-        # Read the LinkedIn profile PDF file to extract text
-        reader = PdfReader(linkedIn_path)  # Initialize the PDF reader with the specified file
-        self.linkedin = ""  # Initialize an empty string to hold the extracted LinkedIn profile tet
 
-        # Iterate over each page in the PDF document
-        for page in reader.pages:
-            text = page.extract_text()  # Extract text from the current page
-            if text:  # Check if any text was extracted
-                self.linkedin = self.linkedin + text  # Concatenate the extracted text to the LinkedIn string
+class Me:
+
+    def __init__(self, name, linkedIn_path, summary_path, stream = None, openai_client = None, notifier = None, evaluation_policy = None,
+                 lead_store = None):
+        self.openai = openai_client or get_openai_client()  # Shared, connection-pooled client unless one is injected
+        self.notifier = notifier or get_notification_dispatcher()  # Shared background notification pipeline unless one is injected
+        self.lead_store = lead_store or get_lead_store()  # Shared store of leads and unknown questions unless one is injected
+        self.name = name
+        
+        # Stream replies token by token unless disabled (constructor argument wins over the CHAT_STREAM variable)
+        self.stream = env_flag("CHAT_STREAM", True) if stream is None else stream
+        
+        # Evaluation mode, sampling, retry budget and verdict cache (EVALUATION_MODE etc. unless a policy is injected)
+        self.evaluation_policy = evaluation_policy or EvaluationPolicy()
+        
+        # Background evaluations run as tasks after the reply; keep references so they are not garbage collected
+        self.background_tasks = set()
+        
+        # Resolve the methods implementing the registered tools once
+        self.tool_handlers = tool_registry.bind(self)
+        
+        # Keep the history sent with each request within a token budget, folding older turns into a cached summary
+        self.history_manager = HistoryManager(
+            self.summarize_history,
+            token_budget = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000")),  # Tokens of verbatim history per request
+            cache_size = int(os.getenv("HISTORY_SUMMARY_CACHE_SIZE", "1024")),  # Summaries kept across conversations
+        )
 
-        # Read the LinkedIn summary from a text file
-        with open(summary_path, "r", encoding = "utf-8") as f:
-            self.summary = f.read()  # Read the entire content of the summary file into the summary variable
+        # Load the LinkedIn text, the summary and their retrieval chunks; the PDF is only parsed when the cache is stale
+        # (PROFILE_CACHE_PATH is a directory holding one cache file per persona, so personas never overwrite each other's)
+        profile = load_profile(linkedIn_path, summary_path, cache_path = default_cache_path(linkedIn_path, os.getenv("PROFILE_CACHE_PATH")))
+        self.linkedin = profile["linkedin"]  # Text extracted from the LinkedIn profile PDF
+        self.summary = profile["summary"]  # Content of the summary file
+        
+        # Render the system prompts once for this profile
+        self.context = PromptContext(self.name, self.summary, self.linkedin, self.evaluation_policy.output)
+        
+        # Version of the profile content; cached replies generated from another version are never served
+        self.profile_version = hashlib.sha256(f"{self.name}\x00{self.summary}\x00{self.linkedin}".encode("utf-8")).hexdigest()
+        
+        # Cache of replies to repeated first-turn questions (RESPONSE_CACHE_ENABLED=false turns it off)
+        self.response_cache = None
+        if env_flag("RESPONSE_CACHE_ENABLED", True):
+            self.response_cache = ResponseCache(
+                self.profile_version,
+                max_size = int(os.getenv("RESPONSE_CACHE_SIZE", "512")),  # Entries kept in memory
+                ttl = float(os.getenv("RESPONSE_CACHE_TTL", "3600")),  # Seconds a cached reply stays valid
+                disk_path = os.getenv("RESPONSE_CACHE_PATH"),  # Optional SQLite file shared across processes and restarts
+            )
+        
+        # Index the profile so that each message only carries the relevant excerpts (RETRIEVAL_ENABLED=false sends it whole)
+        self.retriever = None
+        if env_flag("RETRIEVAL_ENABLED", True):
+            self.retriever = ProfileRetriever(
+                [Chunk.from_dict(chunk) for chunk in profile["chunks"]],
+                top_k = int(os.getenv("RETRIEVAL_TOP_K", "6")),  # Maximum number of excerpts per message
+                token_budget = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "800")),  # Maximum size of the excerpts per message
+            )
+    
+    
+    # Function to get the profile excerpts relevant to a message, or None to use the full profile
+    def profile_excerpts(self, message):
+        if self.retriever is None:
+            return None
+        return self.retriever.retrieve(message)
+    
+    
+    # Function to estimate the memory held by this persona in bytes (profile, rendered prompts, index and caches)
+    def memory_estimate(self):
+        texts = [self.linkedin, self.summary]
+        texts.extend(message["content"] for message in vars(self.context).values() if isinstance(message, dict))
+        size = sum(sys.getsizeof(text) for text in texts)
+        if self.retriever is not None:
+            size = size + 3 * sum(sys.getsizeof(chunk.text) for chunk in self.retriever.chunks)  # Chunks, terms and postings
+        if self.response_cache is not None:
+            size = size + sum(sys.getsizeof(reply) for _, reply in list(self.response_cache.entries.values()))
+        size = size + sum(sys.getsizeof(summary) for summary in list(self.history_manager.summaries.values()))
+        return size
     
     
     # Function to send a notification via Pushover
-    def push(self, message):
-        # Retrieve Pushover API credentials from environment variables
-        pushover_user = os.getenv("PUSHOVER_USER")  # Get the Pushover user key
-        pushover_token = os.getenv("PUSHOVER_TOKEN")  # Get the Pushover API token
-        
-        # Define the Pushover API URL for sending messages
-        pushover_url = "https://api.pushover.net/1/messages.json"
-        
-        # Print the message that will be sent
-        print(f"Push : {message}")
-        
-        # Create the payload for the Pushover API request
-        payload = {
-            "user" : pushover_user,  # The Pushover user key 
-            "token" : pushover_token,  # The Pushover API token
-            "message" : message  # The message content to be sent
-            }
-        
-        # Send a POST request to the Pushover API to deliver the message
-        requests.post(pushover_url, data = payload)
-
+    def push(self, message, kind = "message"):
+        # Hand the message to the background dispatcher, which spools, batches and retries it; this never waits on Pushover.
+        # The pipeline is shared by every persona of the process, so each notification says whose visitor it is about
+        self.notifier.notify(f"[{self.name}] {message}", kind = kind)
+    
     
     # Function to record user details and send a notification
     def record_user_details(self, email = "N/A", name = "N/A", mobile_no = "N/A", notes = "N/A"):
         # Create a formatted message for the notification
-        notification_message = {
+        notification_message = (
             f"New User Interest Notification:\n"
             f"Name: {name}\n"
             f"Email: {email}\n"
             f"Mobile No: {mobile_no}\n"
             f"Notes: {notes}\n"
             f"Please follow up with the user at your earliest convenience."
-        }
+        )
         
-        # Send a notification with the user's details using the push function
-        self.push(notification_message)
+        # Store the lead first; the same visitor leaving their details again only bumps its counter
+        count = self.lead_store.record_lead(self.name, email = email, name = name, mobile_no = mobile_no, notes = notes)
+        
+        # Send a notification with the user's details the first time, and again when the visitor keeps coming back
+        if self.lead_store.should_notify(count):
+            self.push(notification_message if count == 1 else f"{notification_message}\n(Recorded {count} times)", kind = "lead")
         
         # Return a confirmation response indicating that the unknown question has been recorded
         return {"recorded" : "ok"}
@@ -245,239 +497,446 @@ class Me:
 
     # Function to record an unknown question and send a notification
     def record_unknown_question(self, question):
-        # Send a notification with the unknown question using the push function
-        self.push(f"Recording {question} asked that I couldn't answer")
+        # Store the question first; repeats of an already-recorded question (or a near-identical one) only bump its counter
+        count = self.lead_store.record_question(self.name, question)
+        
+        # Notify on the first occurrence and when the count crosses a threshold; bursts are sent together as one digest
+        if self.lead_store.should_notify(count):
+            self.push(question if count == 1 else f"{question} (asked {count} times)", kind = "unknown_question")
         
         # Return a confirmation response indicating that the unknown question has been recorded
         return {"recorded" : "ok"}
     
     
     # Function to handle tool calls made by the LLM
-    def handle_tool_calls(self, tool_calls):
+    async def handle_tool_calls(self, tool_calls):
         """
-        This function processes a list of tool calls generated by the LLM.
-        Each tool call is represented as a ChatCompletionMessageToolCall object.
+        This function processes a list of tool calls generated by the LLM, running independent calls concurrently.
+        Each tool call is a dictionary in the API's tool call format, as assembled from the (streamed) response.
         
         Example of tool_calls:
         [
-            ChatCompletionMessageToolCall(
-                id="call_mnC1KYpiUrlKYEaRqD9U9",
-                function=Function(arguments='{"question":"Can you tell me about Nvidia?"}', name="record_unknown_question"),
-                type="function"
-            )
+            {
+                "id" : "call_mnC1KYpiUrlKYEaRqD9U9",
+                "type" : "function",
+                "function" : {"arguments" : '{"question":"Can you tell me about Nvidia?"}', "name" : "record_unknown_question"}
+            }
         ]
         """
         
-        # Initialize an empty list to store the results of each tool call
-        results = []
+        # Validate and run the calls concurrently; the results come back in the order of the tool calls
+        with StageTimer("tool_calls", calls = len(tool_calls)):
+            return await tool_registry.execute(self.tool_handlers, tool_calls)
+    
+    
+    # Function to call the chat completions API for one stage of the pipeline, recording its latency and token usage
+    async def create_completion(self, stage, budget = "chat", **kwargs):
+        """
+        'budget' is the upstream concurrency budget the call counts against: "chat" for what the visitor waits on,
+        "evaluation" for judging replies. Rate limits, server errors and timeouts are retried (see call_with_retries);
+        Overloaded is raised when too many calls are already waiting for the budget.
+        """
+        create = functools.partial(self.openai.chat.completions.create, model = "gpt-4o-mini", **kwargs)  # One attempt
+        if kwargs.get("stream"):
+            # A stream is timed by its consumer, which also holds the upstream slot until the stream ends
+            return await call_with_retries(create)
         
-        # Iterate over each tool call in the provided list
-        for tool_call in tool_calls:
-            # Extract the name of the function to be called from the tool call object
-            tool_name = tool_call.function.name
-            
-            # Retrieve the arguments for the function, which are stored as a JSON string
-            # Convert the JSON string into a python dictionary for easier access
-            arguments = json.loads(tool_call.function.arguments)
-            
-            # Log the tool name and the arguments being passed for debugging purposes
-            print(f"Tool called : {tool_name} || , arguments passed : {arguments}", flush = True)
-            
-            # Attempt to retrieve the function from the global namespace using its name
-            # tool = globals().get(tool_name)
-            tool = getattr(self, tool_name, None)
-            
-            # Check if the function was successfully retrieved (i.e., it exists)
-            if tool is not None:
-                # Validate the arguments against the expected parameters
-                expected_params = tool.__code__.co_varnames[:tool.__code__.co_argcount]  # Get expected parameter names
-                
-                # Exclude 'self' parameter for bound methods
-                if expected_params and expected_params[0] == "self":
-                    expected_params = expected_params[1:]
-                
-                print(f"Expected parameters for tool '{tool_name}' : {expected_params}")  # Log this for easier understanding
-                
-                # Check for missing parameters
-                missing_params = [param for param in expected_params if param not in arguments]
-                if missing_params:
-                    print(f"Missing parameters for {tool_name} : {missing_params}")
-                    result = {"error" : f"Missing parameters : {missing_params}"}
-                else:
-                    # Call the function with unpacked arguments and store the result
-                    result = tool(**arguments)
-            else:
-                # If the function doesn't exist, initialize the result as an error message
-                result = {"error" : f"Function '{tool_name}' not found."}
-            
-            # Append the result of the function call to the results list
-            # Each entry includes the role, the content of the result, and the ID of the tool call
-            results.append({
-                "role" : "tool",  # Indicates that this entry is a tool result
-                "content" : json.dumps(result),  # Convert the result to a JSON string for consistency
-                "tool_call_id" : tool_call.id  # Include the unique ID of the tool call for reference
-                })
-
-        # Return the compiled list of results from all processed tool calls
-        return results
+        async with get_upstream_limiter(budget).slot():
+            with StageTimer(stage) as timer:
+                response = await call_with_retries(create)
+                timer.usage = response.usage
+        return response
     
     
     # Define a function to extract and convert structured output from a response text
     def structured_output(self, response_text):
-        # Extract the JSON part from the string
-        json_part = response_text.split("```json")[1].split("```")[0].strip()
-        
-        # Convert the extracted string to a JSON object
-        json_object = json.loads(json_part)
+        # Extract the JSON part from the string, when the evaluator enclosed it in a ```json block
+        json_part = response_text or ""  # None when the model refused
+        if "```json" in json_part:
+            json_part = json_part.split("```json")[1].split("```")[0]
         
-        # Now json_object is a Python dictionary
-        return json_object
+        # Validate it against the Evaluation model; a verdict that cannot be read (e.g. cut off by max_tokens) is not a pass
+        try:
+            return Evaluation.model_validate_json(json_part.strip()).model_dump()
+        except ValidationError as error:
+            raise UnreadableEvaluation(str(error)) from error
     
     
     # Define a function to evaluate the Agent's response
-    def evaluate(self, reply, message, history):
+    async def evaluate(self, reply, message, history):
         # Construct the messages to be sent to the LLM for evaluation
-        messages = [
-            {
-                "role" : "system",  # Role of the message sender
-                "content" : Template(evaluator_system_prompt).substitute(
-                    name = "Siddharth Singh",  # Substitute the user's name
-                    linkedin = self.linkedin,  # Substitute the LinkedIn profile
-                    summary = self.summary,  # Substitute the summary
-                    json_schema = evaluation_json_schema,  # Substitute the JSON schema
-                ),
-            },
+        # Give the evaluator the same excerpts the agent was given, or the full profile
+        excerpts = self.profile_excerpts(message)
+        if excerpts is None:
+            context_messages = [self.context.evaluator_system_message]  # Pre-rendered evaluator system prompt
+        else:
+            context_messages = [self.context.evaluator_instructions_message, self.context.excerpts_message(excerpts)]
+        
+        # Give the evaluator a compact transcript instead of the raw history
+        summary, recent = await self.history_manager.compact(history)
+        
+        messages = context_messages + [
             {
                 "role" : "user",  # Role of the user
-                "content" : Template(evaluator_user_prompt).substitute(
-                    history = history,  # Substitute the conversation history
+                "content" : evaluator_user_template.substitute(
+                    history = format_transcript(recent, summary),  # Substitute the compacted conversation history
                     message = message,  # Substitute th latest user message
                     reply = reply  # Substitute the latest agent response
                 ),
             },
         ]
         
-        # Call the LLM to evaluate the response
-        response = self.openai.chat.completions.create(model = "gpt-4o-mini", messages = messages)
+        # Call the LLM to evaluate the response, constrained to the Evaluation schema with a token cap unless "fenced" output is used
+        options = {}
+        if self.evaluation_policy.output == "schema":
+            options = {"response_format" : evaluation_response_format, "max_tokens" : self.evaluation_policy.max_tokens}
+        response = await self.create_completion("evaluate", budget = "evaluation", messages = messages, **options)
         
         # Return the structured output from the response
         return self.structured_output(response.choices[0].message.content)
     
     
-    def rerun(self, reply, message, history, feedback):
-        updated_system_prompt = Template(system_prompt).substitute(
-            name = "Siddharth Singh",  # Substitute the user's name
-            linkedin = self.linkedin,  # Substitute the LinkedIn profile
-            summary = self.summary,  # Substitute the summary
-        ) + "\n\n## Previous answer rejected\nYou just tried to reply, but the quality control rejected your reply\n"
-        updated_system_prompt = updated_system_prompt + f"## Your attempted answer : \n{reply}\n\n"
-        updated_system_prompt = updated_system_prompt + f"## Reason for rejection : \n{feedback}\n\n"
-        
-        # Construct the messages to be sent to the LLM
-        messages = (
-            [
-                {
-                    "role" : "system",  # Role of the message sender
-                    "content" : updated_system_prompt  # Updated system prompt with previous response, and the feedback from LLM
-                }
-            ]
-            + history  # Include the previous chat history
-            + [{"role" : "user", "content" : message}]  # Add the current user message
+    # Function to fold older turns of a conversation into a rolling summary (used by the history manager)
+    async def summarize_history(self, previous_summary, messages):
+        prompt = history_summary_template.substitute(
+            name = self.name,  # Whose representative the Agent is
+            previous_summary = previous_summary or "(none yet)",  # Summary of the turns folded earlier
+            transcript = format_transcript(messages),  # Turns to fold in now
         )
+        response = await self.create_completion("history_summary", messages = [{"role" : "user", "content" : prompt}], max_tokens = 300)
+        return response.choices[0].message.content
+    
+    
+    # Function to answer again after the evaluator rejected a reply
+    async def rerun(self, reply, message, history, feedback):
+        # Construct the messages to be sent to the LLM: the same prefix as the rejected turn, then the rejected
+        # answer and the feedback, so only the tail of the prompt differs from what the provider has cached
+        summary, recent = await self.history_manager.compact(history)
+        messages = self.context.chat_messages(message, recent, self.profile_excerpts(message), summary) + [
+            {"role" : "assistant", "content" : reply},  # The attempted answer that was rejected
+            {"role" : "system", "content" : rejection_template.substitute(feedback = feedback)},  # Reason for rejection
+        ]
         
         # Call the Azure OpenAI chat completion API with the constructed messages
-        response = self.openai.chat.completions.create(model = "gpt-4o-mini", messages = messages)
+        response = await self.create_completion("rerun", messages = messages)
         
         # Return th content of the response from the LLM
         return response.choices[0].message.content
     
     
+    # Function to stream one completion, yielding the reply as it grows and filling in the assembled result
+    async def stream_completion(self, messages, result):
+        """
+        Streams a chat completion and re-assembles it from its deltas into 'result' (a CompletionResult).
+        Content deltas are yielded as the cumulative reply, which is what gr.ChatInterface expects from a generator.
+        Tool call deltas arrive in pieces keyed by their index: the first piece carries the id and function name,
+        the following pieces only carry fragments of the JSON arguments, so they are concatenated per index.
+        """
+        # The chat slot is held until the stream ends, as that is when the upstream request really finishes
+        async with get_upstream_limiter("chat").slot():
+            with StageTimer("chat_completion", streamed = True) as timer:
+                stream = await self.create_completion("chat_completion", messages = messages, tools = tools, stream = True,
+                                                      stream_options = {"include_usage" : True})
+                
+                tool_calls = {}  # Tool calls being assembled, keyed by their index in the message
+                
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        result.usage = timer.usage = chunk.usage  # Keep the token usage reported at the end of the stream
+                    if not chunk.choices:
+                        continue  # The usage chunk carries no delta
+                
+                    choice = chunk.choices[0]
+                    delta = choice.delta
+                
+                    # Grow the reply and hand the partial text to the UI straight away
+                    if delta.content:
+                        if not result.reply:
+                            first_token_seconds.observe(time.perf_counter() - timer.start)  # Time to first token
+                        result.reply = result.reply + delta.content
+                        yield result.reply
+                
+                    # Merge the tool call fragments into complete tool calls
+                    for tool_call_delta in delta.tool_calls or []:
+                        tool_call = tool_calls.setdefault(tool_call_delta.index, {"id" : None, "type" : "function", "function" : {"name" : "", "arguments" : ""}})
+                        if tool_call_delta.id:
+                            tool_call["id"] = tool_call_delta.id
+                        if tool_call_delta.function is not None:
+                            if tool_call_delta.function.name:
+                                tool_call["function"]["name"] = tool_call_delta.function.name
+                            if tool_call_delta.function.arguments:
+                                tool_call["function"]["arguments"] = tool_call["function"]["arguments"] + tool_call_delta.function.arguments
+                
+                    if choice.finish_reason is not None:
+                        result.finish_reason = choice.finish_reason
+                
+                result.tool_calls = [tool_calls[index] for index in sorted(tool_calls)]
+    
+    
+    # Function to run one blocking completion and return it in the same shape as stream_completion
+    async def blocking_completion(self, messages):
+        response = await self.create_completion("chat_completion", messages = messages, tools = tools)
+        message = response.choices[0].message
+        
+        result = CompletionResult()
+        result.reply = message.content or ""
+        result.tool_calls = [
+            {"id" : tool_call.id, "type" : "function", "function" : {"name" : tool_call.function.name, "arguments" : tool_call.function.arguments}}
+            for tool_call in message.tool_calls or []
+        ]
+        result.finish_reason = response.choices[0].finish_reason
+        result.usage = response.usage
+        return result
+    
+    
+    # Function to evaluate a reply through the verdict cache and log the verdict, without letting a failure break the turn
+    async def evaluate_and_log(self, reply, message, history, record = False):
+        try:
+            evaluation, cached = await self.evaluation_policy.evaluate(self.evaluate, reply, message, history)
+            if record:
+                await self.evaluation_policy.record(reply, message, evaluation, cached)  # Keep the verdict for later review
+        except UnreadableEvaluation as error:  # Treated as acceptable like any failure, but neither cached nor recorded
+            logger.warning("Unreadable evaluation, treated as acceptable -> %r", error)
+            count_event("evaluation_unreadable")
+            return None
+        except Exception as error:  # A failed evaluation must not cost the visitor their reply, so it is only logged
+            logger.warning("Evaluation failed -> %r", error)
+            return None
+        
+        logger.debug("Evaluation Result -> %s (cached : %s)", evaluation, cached)
+        count_event("evaluation", acceptable = evaluation["is_acceptable"], cached = cached)
+        if not evaluation["is_acceptable"]:
+            logger.info("Feedback received -> %s", evaluation["feedback"])  # Log feedback for review
+        return evaluation
+    
+    
+    # Function to evaluate a delivered reply in the background, no longer serving it from the response cache if rejected
+    async def evaluate_in_background(self, reply, message, history, cached = False):
+        evaluation = await self.evaluate_and_log(reply, message, history, record = True)
+        if cached and evaluation is not None and not evaluation["is_acceptable"]:
+            await self.response_cache.discard(message, reply)
+    
+    
+    # Function to race alternative candidates against a reply, returning (chosen reply, whether it was accepted)
+    async def speculate(self, reply, message, history, messages):
+        """
+        The first reply is evaluated straight away while N-1 alternatives are generated in one request (the 'n'
+        parameter, so the prompt is only sent once) and each is evaluated as soon as it arrives. The first acceptable
+        candidate wins and everything still running is cancelled. When the deadline passes first, the earliest
+        candidate not known to be rejected is returned, or the first reply when all of them were rejected. This trades
+        completion tokens for the serial evaluate -> rerun -> evaluate round-trips of "blocking" mode.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.evaluation_policy.deadline
+        candidates = [reply]
+        verdicts = {}  # Index of a candidate -> its evaluation (None when the evaluation failed)
+        pending = {asyncio.create_task(self.evaluate_and_log(reply, message, history)) : 0}  # Task -> candidate index, None for the generation
+        if self.evaluation_policy.candidates > 1:
+            # The tool results are already in 'messages', so the alternatives answer without calling tools again
+            generation = self.create_completion("candidates", budget = "evaluation", messages = messages, tools = tools, tool_choice = "none",
+                                                n = self.evaluation_policy.candidates - 1)
+            pending[asyncio.create_task(generation)] = None
+        
+        try:
+            while pending:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                done, _ = await asyncio.wait(pending, timeout = timeout, return_when = asyncio.FIRST_COMPLETED)
+                if not done:
+                    break  # Deadline reached
+                
+                for task in done:
+                    index = pending.pop(task)
+                    if index is None:
+                        # The alternatives arrived: evaluate each of them in parallel
+                        try:
+                            response = task.result()
+                        except Exception as error:  # The first reply is still in the race
+                            logger.warning("Candidate generation failed -> %r", error)
+                            continue
+                        for choice in response.choices:
+                            if choice.message.content:
+                                candidates.append(choice.message.content)
+                                pending[asyncio.create_task(self.evaluate_and_log(choice.message.content, message, history))] = len(candidates) - 1
+                        continue
+                    
+                    evaluation = task.result()  # evaluate_and_log logs failures instead of raising
+                    verdicts[index] = evaluation
+                    if evaluation is None or evaluation["is_acceptable"]:
+                        count_event("speculation", outcome = "accepted", candidate = index)
+                        return candidates[index], True
+        finally:
+            for task in pending:
+                task.cancel()  # Nobody waits for the losers
+        
+        # No acceptable candidate in time: prefer one that was not rejected (still being evaluated), then the first reply
+        count_event("speculation", outcome = "deadline" if pending else "rejected")
+        for index in range(len(candidates)):
+            if index not in verdicts:
+                return candidates[index], False
+        return candidates[0], False
+    
+    
+    # Function to run a coroutine after the reply has been delivered, keeping a reference until it finishes
+    def run_in_background(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+    
+    
     # Function to handle chat interactions with the LLM
-    def chat(self, message, history):
-        # Construct the messages to be sent to the LLM
-        messages = (
-            [
-                {
-                    "role" : "system",  # Role of the message sender, indicating this is a system message
-                    "content" : Template(system_prompt).substitute(
-                        name = "Siddharth Singh",  # Substitute the user's name into the system prompt
-                        linkedin = self.linkedin,  # Substitute the LinkedIn profile text into the system prompt
-                        summary = self.summary  # Substitute the summary text into the system prompt
-                    ),
-                }
-            ]
-            + history  # Include the previous chat history to maintain context
-            + [{"role" : "user", "content" : message}]  # Add the current user message to the messages list
-        )
+    async def chat(self, message, history):
+        """
+        Async generator used by gr.ChatInterface: every yielded value replaces the reply shown so far.
+        When the upstream budget is exhausted (too many calls queued, or the API keeps rate limiting after the retries)
+        the turn ends right away with a short "busy" reply instead of piling up behind everyone else.
+        """
+        try:
+            async for reply in self.respond(message, history):
+                yield reply
+        except (Overloaded, UpstreamUnavailable) as error:
+            logger.warning("Shedding chat turn -> %r", error)
+            count_event("busy_reply")
+            yield busy_reply
+    
+    
+    # Function to produce the reply to a message (see chat)
+    async def respond(self, message, history):
+        """
+        Every yielded value replaces the reply shown so far.
+        While it waits on the API the event loop serves other conversations, so one process can hold many of them.
+        In streaming mode the reply is yielded token by token, otherwise it is yielded once complete.
+        What happens with evaluation depends on the evaluation policy: in "blocking" mode the reply is held back (not
+        streamed) until it passes evaluation or the rerun budget is spent; in "speculative" mode it is held back while
+        alternative candidates are raced against it (see speculate); in "async" and "sampled" modes all or some
+        replies are evaluated in the background after they have been delivered; in "off" mode nothing is evaluated.
+        """
+        turn_start = time.perf_counter()  # For the latency of the whole turn
+        stream_reply = self.stream and not self.evaluation_policy.blocking  # A reply still to be evaluated cannot be shown yet
+        
+        # Serve repeated first-turn questions from the response cache
+        cacheable = self.response_cache is not None and is_history_independent(message, history)
+        if cacheable:
+            cached_reply = await self.response_cache.lookup(message)
+            count_event("response_cache", result = "miss" if cached_reply is None else "hit")
+            if cached_reply is not None:
+                logger.debug("Response cache hit -> %s", self.response_cache.stats())
+                record_stage("turn", time.perf_counter() - turn_start, iterations = 0, cached = True)
+                yield cached_reply
+                return
+        
+        # Construct the messages to be sent to the LLM, with only the parts of the profile relevant to this message and
+        # only as much history as the budget allows
+        summary, recent = await self.history_manager.compact(history)
+        messages = self.context.chat_messages(message, recent, self.profile_excerpts(message), summary)
         
+        iterations = 0  # Number of LLM calls in the tool loop
         done = False  # Initialize a flag to control the loop for processing LLM responses
         while not done:  # Continue processing until the LLM has finished its response
+            iterations = iterations + 1
             # Call the LLM with the constructed messages and the tools available for function calls
-            response = self.openai.chat.completions.create(model = "gpt-4o-mini", messages = messages, tools = tools)
-            
-            # Determine the reason for the LLM's response completion
-            finish_reason = response.choices[0].finish_reason
-            print(f"Finish Reason -> {finish_reason}")  # Log the finish reason for debugging
+            if stream_reply:
+                result = CompletionResult()
+                async for partial_reply in self.stream_completion(messages, result):
+                    yield partial_reply
+            else:
+                result = await self.blocking_completion(messages)
+            logger.debug("Finish Reason -> %s", result.finish_reason)  # Log the finish reason for debugging
             
             # If the LLM indicates it wants to call a tool, handle that case
-            if finish_reason == "tool_calls":
-                # Step 1 - Extract the message from the response, which may contain tool call information
-                message = response.choices[0].message
-                print(f"Message going inside -> {message}")  # Log the extracted message for debugging
-                
-                """
-                Below is an example of how it may look like -
-                Message going inside -> ChatCompletionMessage(content = None, refusal = None, role = "assistant", annotations = [],
-                audio = None, function_call = None, tool_calls = [ChatCompletionMessageToolCall(id = "call_mncajkashasklals", 
-                function = Function(arguments = '{"question" : "Can you tell me about Nvidia?"}', name = "record_unknown_question"), 
-                type = "function")])
-                """
+            if result.finish_reason == "tool_calls":
+                logger.debug("Tool calls -> %s", result.tool_calls)  # Log the tool calls for debugging
                 
-                # Step 2 - Extract tool_calls details from the 'ChatCompletionMessage'
-                tool_calls = message.tool_calls  # Retrieve the list of tool calls requested by the LLM
-                print(f"Tool calls -> {tool_calls}")  # Log the tool calls for debugging
+                # Tools record details about this visitor (record_user_details) or this question, so the turn must not
+                # be replayed to someone else from the cache
+                cacheable = False
                 
-                """
-                Below is an example of how it may look like -
-                Message going inside -> [ChatCompletionMessageToolCall(id = "call_mncajkashasklals", 
-                function = Function(arguments = '{"question" : "Can you tell me about Nvidia?"}', name = "record_unknown_question"), 
-                type = "function")]
-                """
-                
-                # Step 3 - Call the function 'handle_tool_calls' to process the function execution
-                results = self.handle_tool_calls(tool_calls)  # Process the tool calls and obtain results
-                print(f"Final Result -> {results}")  # Log the final results for debugging
+                # Process the tool calls and obtain results
+                results = await self.handle_tool_calls(result.tool_calls)
+                logger.debug("Final Result -> %s", results)  # Log the final results for debugging
                 
                 # Append the LLM's message and the results from tool calls to the message list
-                messages.append(message)  # Add the LLM's message to the conversation history
+                messages.append({"role" : "assistant", "content" : result.reply or None, "tool_calls" : result.tool_calls})
                 messages.extend(results)  # Add the results from the tool calls to the conversation history
             else:
                 done = True  # Exit the loop if no tool calls are made, indicating the LLM has finished processing
         
-        # Return the content of the response from the LLM
-        LLM_response = response.choices[0].message.content
-        print(f"Reply -> {LLM_response}")
+        LLM_response = result.reply
+        logger.debug("Reply -> %s", LLM_response)
+        turn_iterations.observe(iterations)  # Token usage of each call is recorded by the chat_completion stage
         
-        # Evaluate the LLM's response
-        evaluation = self.evaluate(LLM_response, message, history)
-        print(f"Evaluation Result -> {evaluation}")
+        if self.evaluation_policy.speculative:
+            LLM_response, accepted = await self.speculate(LLM_response, message, history, messages)
+            record_stage("turn", time.perf_counter() - turn_start, iterations = iterations, accepted = accepted)
+            yield LLM_response
+            if cacheable and accepted and LLM_response:
+                await self.response_cache.store(message, LLM_response)
+            return
         
-        # Extract token usage details
-        token_count = response.usage.total_tokens  # Adjust based on the actual structure of the response
-        print(f"Token count -> {token_count}")  # Print the token count for monitoring
+        if self.evaluation_policy.blocking:
+            # Evaluate the LLM's response before it is shown, rerunning rejected replies within the retry budget
+            for attempt in range(self.evaluation_policy.max_reruns + 1):
+                evaluation = await self.evaluate_and_log(LLM_response, message, history)
+                if evaluation is None or evaluation["is_acceptable"]:
+                    logger.debug("Passed Evaluation - Returning reply")
+                    break
+                if attempt == self.evaluation_policy.max_reruns:
+                    logger.info("Failed Evaluation - Retry budget spent, returning last reply")
+                    cacheable = False  # Do not keep serving a reply the evaluator rejected
+                    break
+                logger.info("Failed Evaluation - Retrying")
+                LLM_response = await self.rerun(LLM_response, message, history, evaluation["feedback"])  # Retry Logic
+            record_stage("turn", time.perf_counter() - turn_start, iterations = iterations, reruns = attempt)
+            yield LLM_response
+            if cacheable and LLM_response:
+                await self.response_cache.store(message, LLM_response)
+            return
         
-        # Check if the evaluation indicates the response is acceptable
-        if evaluation["is_acceptable"]:
-            print("Passed Evaluation - Returning reply")
-            return LLM_response  # Return the acceptable reply
-        else:
-            print("Failed Evaluation - Retrying")
-            print(f"Feedback received -> {evaluation['feedback']}")  # Print feedback for debugging
-            # new_LLM_response = rerun(LLM_response, message, history, evaluation["feedback"])  # Retry Logic
-            # return new_LLM_response  # Return the new reply after retrying
-            return LLM_response  # Return the acceptable reply
+        record_stage("turn", time.perf_counter() - turn_start, iterations = iterations)
+        if not stream_reply:
+            yield LLM_response  # Deliver the complete reply
+        
+        cached = cacheable and bool(LLM_response)
+        if cached:
+            await self.response_cache.store(message, LLM_response)
+        
+        # The visitor has the whole reply already, evaluate it (or a sample of replies) off the reply path
+        if self.evaluation_policy.should_evaluate_in_background():
+            self.run_in_background(self.evaluate_in_background(LLM_response, message, history, cached))
     
 
+# The Gradio UI; for the headless JSON/SSE API without Gradio, run server.py instead
 if __name__ == "__main__":
-    me = Me(name = "Siddharth Singh", linkedIn_path = "me/personal_linkedIn.pdf", summary_path = "me/summary.txt")
-    gr.ChatInterface(me.chat, type = "messages").launch()
\ No newline at end of file
+    import gradio as gr  # Imported here, so that the headless server never loads it
+    import math  # For rounding up the wait of rate-limited visitors
+    from admission import get_client_rate_limiter
+    from metrics import configure_logging, serve_metrics
+    configure_logging()  # LOG_LEVEL and the JSON metrics log
+    serve_metrics()  # Prometheus endpoint on METRICS_PORT
+    
+    # Every directory shaped like me/ under PERSONAS_DIR is a persona, loaded on first use; they all share one API client
+    # and one notification pipeline
+    registry = PersonaRegistry(Me)
+    registry.get()  # Load the default persona before the first visitor arrives
+    
+    # Route each chat to its persona: the X-Persona header, else ?persona=<name> in the page URL, else DEFAULT_PERSONA
+    async def chat(message, history, request : gr.Request):
+        # Per-visitor rate limit (RATE_LIMIT_KEY picks the IP address or the Gradio session)
+        rate_limiter = get_client_rate_limiter()
+        wait = rate_limiter.check(rate_limiter.client_key(request.client.host if request.client else None, request.session_hash))
+        if wait:
+            yield rate_limited_template.substitute(seconds = math.ceil(wait))
+            return
+        
+        try:
+            persona = await registry.aget(registry.resolve(request.query_params.get("persona"), dict(request.headers)))
+        except KeyError as error:
+            raise gr.Error(str(error))
+        async for reply in persona.chat(message, history):
+            yield reply
+    
+    # Gradio runs the async handler on its event loop; lift the default limit of one concurrent chat per event so that
+    # conversations are only bounded by the upstream budgets, which shed load with a "busy" reply
+    gr.ChatInterface(chat, type = "messages", concurrency_limit = None).launch()
\ No newline at end of file
@@ -0,0 +1,270 @@
+# Import necessary libraries
+import argparse  # For the command line interface
+import asyncio  # For evaluating several records at once
+import collections  # For the window of records in flight
+import hashlib  # For the dedup keys
+import json  # For the input and output records
+import logging  # For reporting failed evaluations
+import os  # For interacting with the operating system
+import sqlite3  # For the checkpoint and the verdicts already reached
+import sys  # For the progress line
+import time  # For the progress line
+
+
+# Logger of this module
+logger = logging.getLogger(__name__)
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS verdicts (
+    key TEXT PRIMARY KEY,
+    is_acceptable INTEGER NOT NULL,
+    feedback TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS progress (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    line INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    counts TEXT NOT NULL
+);
+"""
+
+
+# Function to compute the key a record is deduplicated by: the persona and the exact history, message and reply
+def record_key(persona, history, message, reply):
+    return hashlib.sha256(json.dumps([persona, history, message, reply], ensure_ascii = False, sort_keys = True).encode("utf-8")).hexdigest()
+
+
+# Function to read and validate one input line, returning (history, message, reply, id) or raising ValueError
+def parse_record(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise ValueError("Line must be JSON")
+    if not isinstance(record, dict):
+        raise ValueError("Line must be a JSON object")
+
+    message, reply = record.get("message"), record.get("reply")
+    if not isinstance(message, str) or not isinstance(reply, str):
+        raise ValueError("'message' and 'reply' must be strings")
+
+    # History in the same "messages" format as the chat: [{"role" : "user" | "assistant", "content" : "..."}, ...]
+    history = record.get("history") or []
+    if not isinstance(history, list) or not all(isinstance(entry, dict) and entry.get("role") in ("user", "assistant") for entry in history):
+        raise ValueError("'history' must be a list of {'role' : 'user' | 'assistant', 'content' : ...} objects")
+    return history, message, reply, record.get("id")
+
+
+# Evaluates a JSON Lines file of (history, message, reply) records, streaming the verdicts in input order
+class BatchEvaluation:
+    """
+    Records are read one line at a time and at most 'concurrency' evaluations are in flight; verdicts are written in
+    input order, so at most 'window' records are held in memory whatever the size of the input. Identical records
+    (same persona, history, message and reply) are evaluated once: later copies reuse the verdict, whether it was
+    reached earlier in this run, in a previous run or is still being reached.
+
+    The checkpoint is a SQLite file holding the verdicts reached so far, the number of input lines handled and the size
+    of the output at that point. A run resumed from it truncates the output back to that size and carries on from the
+    next line, so an interrupted run produces the same output as an uninterrupted one.
+
+    Besides one {"type" : "verdict", ...} record per input line, a {"type" : "summary", ...} record with the running
+    acceptance rate is written every 'summary_every' lines and at the end.
+    """
+
+    def __init__(self, persona, output_path, checkpoint_path, concurrency = 8, window = None, checkpoint_every = 100, summary_every = 1000):
+        self.persona = persona  # Me object whose evaluator is used
+        self.concurrency = concurrency  # Evaluations in flight at most
+        self.window = window or concurrency * 4  # Records read but not yet written at most
+        self.checkpoint_every = checkpoint_every  # Lines between checkpoints
+        self.summary_every = summary_every  # Lines between summary records
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = {}  # Key -> task of the evaluation reaching its verdict, for copies read meanwhile
+
+        self.db = sqlite3.connect(checkpoint_path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(schema)
+
+        # Resume from the checkpoint, dropping output written after it
+        row = self.db.execute("SELECT line, offset, counts FROM progress WHERE id = 1").fetchone()
+        self.line, offset, counts = row if row is not None else (0, 0, "{}")
+        self.counts = collections.Counter(json.loads(counts))  # records / evaluated / reused / failed / invalid / accepted / rejected
+        if offset > (os.path.getsize(output_path) if os.path.exists(output_path) else 0):
+            raise ValueError(f"{output_path} is shorter than its checkpoint {checkpoint_path}, start over with --fresh")
+        self.output = open(output_path, "a+", encoding = "utf-8")
+        self.output.seek(offset)
+        self.output.truncate()
+
+
+    # Function to save the progress made so far, together with the verdicts it relies on
+    def checkpoint(self):
+        self.output.flush()
+        os.fsync(self.output.fileno())  # The output must be on disk before the checkpoint that points past it
+        self.db.execute("INSERT OR REPLACE INTO progress (id, line, offset, counts) VALUES (1, ?, ?, ?)",
+                        (self.line, self.output.tell(), json.dumps(self.counts)))
+        self.db.commit()
+
+
+    # Function to describe the run so far
+    def summary(self):
+        judged = self.counts["accepted"] + self.counts["rejected"]
+        return {
+            "type" : "summary",
+            "lines" : self.line,  # Input lines handled
+            **{name : self.counts[name] for name in ("records", "evaluated", "reused", "failed", "invalid", "accepted", "rejected")},
+            "acceptance_rate" : self.counts["accepted"] / judged if judged else None,  # Share of the records with a verdict that were accepted
+        }
+
+
+    # Function to evaluate one record, returning its verdict or raising
+    async def evaluate(self, history, message, reply):
+        async with self.semaphore:
+            verdict = await self.persona.evaluate(reply, message, history)
+        return {"is_acceptable" : bool(verdict["is_acceptable"]), "feedback" : str(verdict["feedback"])}
+
+
+    # Function to start handling one input line, returning what 'finish' needs to write its result
+    def start(self, number, line):
+        try:
+            history, message, reply, record_id = parse_record(line)
+        except ValueError as error:
+            return number, None, None, {"error" : str(error)}
+
+        key = record_key(self.persona.name, history, message, reply)
+        row = self.db.execute("SELECT is_acceptable, feedback FROM verdicts WHERE key = ?", (key,)).fetchone()
+        if row is not None:  # Reached for an earlier copy of the record
+            return number, record_id, key, {"is_acceptable" : bool(row[0]), "feedback" : row[1], "reused" : True}
+
+        task = self.in_flight.get(key)
+        if task is not None:  # An earlier copy of the record is being evaluated
+            return number, record_id, key, task
+        task = self.in_flight[key] = asyncio.create_task(self.evaluate(history, message, reply))
+        return number, record_id, key, task
+
+
+    # Function to write the result of one input line, in input order
+    async def finish(self, number, record_id, key, result):
+        record = {"type" : "verdict", "line" : number}
+        if record_id is not None:
+            record["id"] = record_id
+
+        if isinstance(result, asyncio.Task):
+            reused = self.in_flight.get(key) is not result  # The copy that started the evaluation removes it from in_flight
+            try:
+                verdict = await asyncio.shield(result)  # Copies share the task, so one cancelled wait must not cancel it for them
+            except Exception as error:  # E.g. the upstream stayed unavailable; costs this record its verdict, not the run
+                logger.warning("Evaluation of line %s failed -> %r", number, error)
+                verdict = {"error" : repr(error)}
+            else:
+                if not reused:
+                    self.db.execute("INSERT OR REPLACE INTO verdicts (key, is_acceptable, feedback) VALUES (?, ?, ?)",
+                                    (key, verdict["is_acceptable"], verdict["feedback"]))
+                verdict = dict(verdict, reused = reused)
+            if not reused:
+                del self.in_flight[key]
+            result = verdict
+        record.update(result)
+
+        if key is None:
+            self.counts["invalid"] += 1
+        else:
+            self.counts["records"] += 1
+            if "error" in result:
+                self.counts["failed"] += 1
+            else:
+                self.counts["reused" if result["reused"] else "evaluated"] += 1
+                self.counts["accepted" if result["is_acceptable"] else "rejected"] += 1
+
+        self.output.write(json.dumps(record, ensure_ascii = False) + "\n")
+        self.line = number + 1
+        if self.line % self.summary_every == 0:
+            self.output.write(json.dumps(self.summary(), ensure_ascii = False) + "\n")
+        if self.line % self.checkpoint_every == 0:
+            self.checkpoint()
+
+
+    # Function to evaluate every record of the input file from the checkpoint on
+    async def run(self, input_path, progress = False):
+        window = collections.deque()  # Started lines, oldest first, waiting to be written
+        started = time.perf_counter()
+        try:
+            with open(input_path, "r", encoding = "utf-8") as f:
+                for number, line in enumerate(f):
+                    if number < self.line or not line.strip():
+                        continue  # Handled before the checkpoint, or blank
+                    window.append(self.start(number, line))
+                    while window and (len(window) >= self.window or not isinstance(window[0][3], asyncio.Task) or window[0][3].done()):
+                        await self.finish(*window.popleft())
+                        if progress and self.line % 100 == 0:
+                            self.report(started)
+            while window:
+                await self.finish(*window.popleft())
+            self.output.write(json.dumps(self.summary(), ensure_ascii = False) + "\n")
+        finally:
+            for *_, result in window:  # Interrupted: what was not written is redone on resume
+                if isinstance(result, asyncio.Task):
+                    result.cancel()
+            self.checkpoint()
+            if progress:
+                self.report(started)
+                sys.stderr.write("\n")
+
+
+    # Function to show the progress of the run on one line of standard error
+    def report(self, started):
+        summary = self.summary()
+        rate = f"{summary['acceptance_rate']:.1%}" if summary["acceptance_rate"] is not None else "-"
+        sys.stderr.write(f"\r{summary['lines']} lines in {time.perf_counter() - started:.0f}s   evaluated {summary['evaluated']}   "
+                         f"reused {summary['reused']}   failed {summary['failed']}   invalid {summary['invalid']}   accepted {rate}")
+        sys.stderr.flush()
+
+
+    # Function to close the checkpoint and the output
+    def close(self):
+        self.db.close()
+        self.output.close()
+
+
+# Function to run a batch evaluation from the command line arguments
+async def main(args):
+    from app import Me  # Imported only now, so that --help stays fast
+    from personas import PersonaRegistry
+
+    persona = await PersonaRegistry(Me).aget(args.persona)
+    batch = BatchEvaluation(persona, args.output, args.checkpoint, args.concurrency,
+                            checkpoint_every = args.checkpoint_every, summary_every = args.summary_every)
+    try:
+        await batch.run(args.input, progress = not args.quiet)
+    finally:
+        batch.close()
+
+
+# Re-evaluates past conversations, e.g. after changing the prompts or the profile: python batch_evaluation.py conversations.jsonl -o verdicts.jsonl
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Evaluate a JSON Lines file of {'history', 'message', 'reply'} records and stream the verdicts and acceptance rates.")
+    parser.add_argument("input", help = "JSON Lines file, one {'history' : [...], 'message' : ..., 'reply' : ..., 'id' : optional} object per line")
+    parser.add_argument("-o", "--output", required = True, help = "JSON Lines file the verdicts and summaries are written to")
+    parser.add_argument("--checkpoint", default = None, help = "Checkpoint to resume from and update (default: the output path + .checkpoint)")
+    parser.add_argument("--fresh", action = "store_true", help = "Ignore an existing checkpoint and start over")
+    parser.add_argument("--persona", default = None, help = "Persona whose evaluator is used (default: DEFAULT_PERSONA)")
+    parser.add_argument("--concurrency", type = int, default = 8, help = "Evaluations in flight at once")
+    parser.add_argument("--checkpoint-every", type = int, default = 100, help = "Lines between checkpoints")
+    parser.add_argument("--summary-every", type = int, default = 1000, help = "Lines between summary records")
+    parser.add_argument("--quiet", action = "store_true", help = "Do not show the progress on standard error")
+    args = parser.parse_args()
+
+    args.checkpoint = args.checkpoint or args.output + ".checkpoint"
+    if args.fresh:
+        for path in (args.output, args.checkpoint, args.checkpoint + "-wal", args.checkpoint + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Let every evaluation of the batch hold an upstream slot instead of queueing (and being shed) behind the limiter
+    os.environ["UPSTREAM_EVALUATION_CONCURRENCY"] = str(max(args.concurrency, int(os.getenv("UPSTREAM_EVALUATION_CONCURRENCY", "16"))))
+
+    from metrics import configure_logging  # For the log settings
+    configure_logging()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        sys.stderr.write(f"Interrupted, run the same command again to resume from {args.checkpoint}\n")
@@ -0,0 +1,190 @@
+# Import necessary libraries
+import argparse  # For the command line interface
+import json  # For parsing requests and serializing responses
+import random  # For the share of replies the fake evaluator rejects
+import re  # For the messages that trigger scripted tool calls
+import threading  # For serving in a background thread
+import time  # For the simulated latency
+import uuid  # For the ids of completions and tool calls
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # For the HTTP server
+
+
+# Scripted tool calls: a user message matching the pattern makes the fake model call the tool with these arguments
+email_pattern = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+unknown_question_pattern = re.compile(r"\b(favou?rite|hobby|hobbies|pets?)\b", re.IGNORECASE)
+
+
+# Function to build the scripted tool calls for a user message (empty when it triggers none)
+def scripted_tool_calls(message):
+    tool_calls = []
+    email = email_pattern.search(message)
+    if email:
+        tool_calls.append(("record_user_details", {"email" : email.group(0), "name" : "Benchmark Visitor", "notes" : message[:200]}))
+    if unknown_question_pattern.search(message):
+        tool_calls.append(("record_unknown_question", {"question" : message}))
+    return [
+        {"id" : f"call_{uuid.uuid4().hex[:24]}", "type" : "function", "function" : {"name" : name, "arguments" : json.dumps(arguments)}}
+        for name, arguments in tool_calls
+    ]
+
+
+# Latency and reply shape of the fake model
+class FakeModelSettings:
+    def __init__(self, first_token_latency = 0.3, token_interval = 0.01, reply_tokens = 60, reject_rate = 0.0, rate_limit_rate = 0.0):
+        self.first_token_latency = first_token_latency  # Seconds before the first token (or the whole non-streamed reply)
+        self.token_interval = token_interval  # Seconds between streamed tokens
+        self.reply_tokens = reply_tokens  # Tokens per chat reply
+        self.reject_rate = reject_rate  # Share of replies the fake evaluator marks as not acceptable
+        self.rate_limit_rate = rate_limit_rate  # Share of requests answered with a 429 and a Retry-After header
+
+
+# Serves POST /v1/chat/completions like the OpenAI API, streamed or not, with tool calls scripted from the user message
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so the client's connection pool behaves as it does against the real API
+    settings = FakeModelSettings()
+
+
+    # Function to decide what the fake model answers: (content, tool calls)
+    def answer(self, request):
+        messages = request.get("messages", [])
+        last = messages[-1] if messages else {"role" : "user", "content" : ""}
+        content = last.get("content") or ""
+
+        # The evaluator: any request that asks for the Evaluation JSON
+        if request.get("response_format") or any("is_acceptable" in (message.get("content") or "") for message in messages):
+            acceptable = random.random() >= self.settings.reject_rate
+            verdict = json.dumps({"is_acceptable" : acceptable, "feedback" : "" if acceptable else "Too vague, give specifics."})
+            return (verdict if request.get("response_format") else f"```json\n{verdict}\n```"), []
+
+        # The chat model: scripted tool calls on a fresh user message, then a reply once the tool results are in
+        if request.get("tools") and request.get("tool_choice") != "none" and last.get("role") == "user":
+            tool_calls = scripted_tool_calls(content)
+            if tool_calls:
+                return None, tool_calls
+
+        words = "Thanks for asking, here is a detailed answer about my background and experience".split()
+        offset = random.randrange(len(words))  # Vary the replies, so that candidates of one turn differ
+        return " ".join(words[(offset + index) % len(words)] for index in range(self.settings.reply_tokens)), []
+
+
+    # Function to estimate the usage of a request in the API's format
+    def usage(self, request, content, tool_calls):
+        prompt_tokens = sum(len(message.get("content") or "") for message in request.get("messages", [])) // 4
+        completion_tokens = len((content or "").split()) + sum(len(call["function"]["arguments"]) // 4 for call in tool_calls)
+        return {"prompt_tokens" : prompt_tokens, "completion_tokens" : completion_tokens, "total_tokens" : prompt_tokens + completion_tokens,
+                "prompt_tokens_details" : {"cached_tokens" : 0}}
+
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))) or b"{}")
+        if random.random() < self.settings.rate_limit_rate:
+            body = b'{"error":{"message":"Rate limit reached","type":"requests","code":"rate_limit_exceeded"}}'
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("retry-after-ms", "200")
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        content, tool_calls = self.answer(request)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = request.get("model", "gpt-4o-mini")
+        finish_reason = "tool_calls" if tool_calls else "stop"
+
+        time.sleep(self.settings.first_token_latency)
+
+        if not request.get("stream"):
+            # One choice per requested candidate ('n'), each answered on its own
+            answers = [(content, tool_calls)] + [self.answer(request) for _ in range(int(request.get("n") or 1) - 1)]
+            body = json.dumps({
+                "id" : completion_id, "object" : "chat.completion", "created" : int(time.time()), "model" : model,
+                "choices" : [{"index" : index, "finish_reason" : "tool_calls" if choice_tool_calls else "stop",
+                              "message" : {"role" : "assistant", "content" : choice_content, "tool_calls" : choice_tool_calls or None}}
+                             for index, (choice_content, choice_tool_calls) in enumerate(answers)],
+                "usage" : self.usage(request, content, tool_calls),
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        # Function to send one server-sent event as one HTTP chunk
+        def send_event(data):
+            event = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+            self.wfile.flush()
+
+        # Function to send one delta of the completion
+        def send_delta(delta, finish = None):
+            send_event(json.dumps({"id" : completion_id, "object" : "chat.completion.chunk", "created" : int(time.time()), "model" : model,
+                                   "choices" : [{"index" : 0, "delta" : delta, "finish_reason" : finish}]}))
+
+        send_delta({"role" : "assistant", "content" : ""})
+        if tool_calls:
+            for index, tool_call in enumerate(tool_calls):
+                # Like the API: the id and name first, then the arguments in fragments
+                send_delta({"tool_calls" : [{"index" : index, "id" : tool_call["id"], "type" : "function",
+                                             "function" : {"name" : tool_call["function"]["name"], "arguments" : ""}}]})
+                arguments = tool_call["function"]["arguments"]
+                for start in range(0, len(arguments), 16):
+                    send_delta({"tool_calls" : [{"index" : index, "function" : {"arguments" : arguments[start:start + 16]}}]})
+        else:
+            for index, word in enumerate(content.split(" ")):
+                if index:
+                    time.sleep(self.settings.token_interval)
+                send_delta({"content" : word if index == 0 else f" {word}"})
+        send_delta({}, finish_reason)
+
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send_event(json.dumps({"id" : completion_id, "object" : "chat.completion.chunk", "created" : int(time.time()), "model" : model,
+                                   "choices" : [], "usage" : self.usage(request, content, tool_calls)}))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client cancelled the request, e.g. a speculative candidate that lost the race
+
+
+    def log_message(self, format, *args):
+        pass  # One line per request would dominate the benchmark output
+
+
+# Function to start the fake OpenAI server in a background thread, returning the server (its port is server.server_port)
+def serve_fake_openai(port = 0, settings = None, host = "127.0.0.1"):
+    handler = type("ConfiguredFakeOpenAIHandler", (FakeOpenAIHandler,), {"settings" : settings or FakeModelSettings()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target = server.serve_forever, name = "fake-openai", daemon = True).start()
+    return server
+
+
+# Run standalone, e.g. to point the app at it: OPENAI_BASE_URL=http://127.0.0.1:8100/v1 python app.py
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Local stand-in for the OpenAI chat completions API.")
+    parser.add_argument("--port", type = int, default = 8100)
+    parser.add_argument("--first-token-latency", type = float, default = 0.3, help = "Seconds before the first token")
+    parser.add_argument("--token-interval", type = float, default = 0.01, help = "Seconds between streamed tokens")
+    parser.add_argument("--reply-tokens", type = int, default = 60, help = "Tokens per chat reply")
+    parser.add_argument("--reject-rate", type = float, default = 0.0, help = "Share of replies the evaluator rejects (0 to 1)")
+    parser.add_argument("--rate-limit-rate", type = float, default = 0.0, help = "Share of requests answered with a 429 (0 to 1)")
+    args = parser.parse_args()
+
+    server = serve_fake_openai(args.port, FakeModelSettings(args.first_token_latency, args.token_interval, args.reply_tokens, args.reject_rate,
+                                                            args.rate_limit_rate))
+    print(f"Fake OpenAI API on http://127.0.0.1:{server.server_port}/v1")
+    threading.Event().wait()
@@ -0,0 +1,68 @@
+# Import necessary libraries
+import argparse  # For the command line interface
+import random  # For the share of requests that fail
+import threading  # For serving in a background thread and counting requests
+import time  # For the simulated latency
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # For the HTTP server
+
+
+# Latency and failures of the fake endpoint, and what it received
+class FakePushoverState:
+    def __init__(self, latency = 0.05, failure_rate = 0.0):
+        self.latency = latency  # Seconds per request
+        self.failure_rate = failure_rate  # Share of requests answered with a 503
+        self.received = 0  # Requests accepted
+        self.failed = 0  # Requests answered with an error
+        self.lock = threading.Lock()
+
+
+# Serves POST /1/messages.json like the Pushover API
+class FakePushoverHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real endpoint
+    state = FakePushoverState()
+
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        time.sleep(self.state.latency)
+
+        failed = random.random() < self.state.failure_rate
+        with self.state.lock:
+            if failed:
+                self.state.failed += 1
+            else:
+                self.state.received += 1
+
+        body = b'{"status":0,"errors":["unavailable"]}' if failed else b'{"status":1,"request":"benchmark"}'
+        self.send_response(503 if failed else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass  # One line per request would dominate the benchmark output
+
+
+# Function to start the fake Pushover endpoint in a background thread, returning the server and its state
+def serve_fake_pushover(port = 0, state = None, host = "127.0.0.1"):
+    state = state or FakePushoverState()
+    handler = type("ConfiguredFakePushoverHandler", (FakePushoverHandler,), {"state" : state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target = server.serve_forever, name = "fake-pushover", daemon = True).start()
+    return server, state
+
+
+# Run standalone, e.g.: PUSHOVER_URL=http://127.0.0.1:8101/1/messages.json python app.py
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Local stand-in for the Pushover messages API.")
+    parser.add_argument("--port", type = int, default = 8101)
+    parser.add_argument("--latency", type = float, default = 0.05, help = "Seconds per request")
+    parser.add_argument("--failure-rate", type = float, default = 0.0, help = "Share of requests answered with a 503 (0 to 1)")
+    args = parser.parse_args()
+
+    server, _ = serve_fake_pushover(args.port, FakePushoverState(args.latency, args.failure_rate))
+    print(f"Fake Pushover API on http://127.0.0.1:{server.server_port}/1/messages.json")
+    threading.Event().wait()
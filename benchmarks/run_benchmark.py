@@ -0,0 +1,174 @@
+# Import necessary libraries
+import argparse  # For the command line interface
+import asyncio  # For running the conversations concurrently
+import json  # For the scripted conversations and the JSON report
+import multiprocessing  # For running the fake servers outside the measured process
+import os  # For interacting with the operating system
+import sys  # For importing the app from the repository root
+import tempfile  # For keeping the spool and verdict files of a run out of the repository
+import time  # For timing turns
+import tracemalloc  # For the memory used per session
+
+
+# The repository root, where the app and the profile live
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+
+# Function to run both fake servers in a child process, so their threads do not compete with the app for the GIL
+def run_fake_servers(model_settings, push_latency, ports):
+    sys.path.insert(0, BENCHMARKS)
+    from fake_openai import FakeModelSettings, serve_fake_openai
+    from fake_pushover import FakePushoverState, serve_fake_pushover
+
+    openai_server = serve_fake_openai(settings = FakeModelSettings(**model_settings))
+    pushover_server, _ = serve_fake_pushover(state = FakePushoverState(latency = push_latency))
+    ports.put((openai_server.server_port, pushover_server.server_port))
+    time.sleep(10 ** 9)  # Serve until the parent terminates the process
+
+
+# Function to get a percentile of a list of values (nearest rank)
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+# Function to replay one scripted conversation through Me.chat, appending (turn latency, time to first token) per turn
+async def run_session(me, conversation, timings):
+    history = []
+    for message in conversation:
+        start = time.perf_counter()
+        first_token = None
+        reply = ""
+        async for reply in me.chat(message, history):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+        timings.append((time.perf_counter() - start, first_token))
+        history = history + [{"role" : "user", "content" : message}, {"role" : "assistant", "content" : reply}]
+
+
+# Function to run 'sessions' conversations with at most 'concurrency' in flight, returning the per-turn timings
+async def run_load(me, conversations, sessions, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def bounded(index):
+        async with semaphore:
+            await run_session(me, conversations[index % len(conversations)], timings)
+
+    await asyncio.gather(*(bounded(index) for index in range(sessions)))
+    return timings
+
+
+# Function to measure the peak memory of 'concurrency' simultaneous sessions, per session
+async def measure_memory(me, conversations, concurrency):
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    await asyncio.gather(*(run_session(me, conversations[index % len(conversations)], []) for index in range(concurrency)))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (peak - baseline) / concurrency, (current - baseline) / concurrency
+
+
+# Function to summarize the mean duration of each pipeline stage from the app's metrics
+def stage_means():
+    from metrics import stage_seconds
+    means = {}
+    with stage_seconds.lock:
+        for key, series in stage_seconds.series.items():
+            count = sum(series[:-1])
+            if count:
+                means[dict(key)["stage"]] = (count, series[-1] / count)
+    return means
+
+
+async def main(args):
+    with open(args.conversations, "r", encoding = "utf-8") as f:
+        conversations = json.load(f)
+
+    import app  # Imported only now, so that it picks up the endpoints of the fake servers
+    me = app.Me(name = args.name, linkedIn_path = os.path.join(ROOT, "me", "personal_linkedIn.pdf"),
+                summary_path = os.path.join(ROOT, "me", "summary.txt"))
+
+    await run_session(me, conversations[0][:1], [])  # Warm up the connection pool and the lazy imports
+
+    start = time.perf_counter()
+    timings = await run_load(me, conversations, args.sessions, args.concurrency)
+    elapsed = time.perf_counter() - start
+
+    peak_per_session, retained_per_session = await measure_memory(me, conversations, args.concurrency)
+    await asyncio.gather(*me.background_tasks, return_exceptions = True)  # Let background evaluations finish
+
+    latencies = [latency for latency, _ in timings]
+    first_tokens = [first_token for _, first_token in timings if first_token is not None]
+    report = {
+        "sessions" : args.sessions,
+        "concurrency" : args.concurrency,
+        "turns" : len(timings),
+        "seconds" : elapsed,
+        "turns_per_second" : len(timings) / elapsed,
+        "turn_latency" : {name : percentile(latencies, fraction) for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))},
+        "time_to_first_token" : {name : percentile(first_tokens, fraction) for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))},
+        "memory_per_session_bytes" : {"peak" : peak_per_session, "retained" : retained_per_session},
+        "stages" : {stage : {"count" : count, "mean_seconds" : mean} for stage, (count, mean) in sorted(stage_means().items())},
+    }
+
+    print(f"{report['turns']} turns in {elapsed:.2f}s over {args.sessions} sessions at concurrency {args.concurrency} "
+          f"-> {report['turns_per_second']:.1f} turns/s")
+    for title, key in (("Turn latency", "turn_latency"), ("Time to first token", "time_to_first_token")):
+        values = report[key]
+        print(f"{title:<20} p50 {values['p50'] * 1000:8.1f} ms   p95 {values['p95'] * 1000:8.1f} ms   p99 {values['p99'] * 1000:8.1f} ms")
+    print(f"{'Memory per session':<20} peak {peak_per_session / 1024:8.1f} KiB   retained {retained_per_session / 1024:8.1f} KiB")
+    for stage, values in report["stages"].items():
+        print(f"  {stage:<18} {values['count']:6d} x {values['mean_seconds'] * 1000:8.1f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding = "utf-8") as f:
+            json.dump(report, f, indent = 2)
+
+    me.notifier.close(timeout = 5)
+
+
+# Replays scripted conversations against local fake OpenAI and Pushover servers: python benchmarks/run_benchmark.py --concurrency 20
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Measure turn latency, time to first token, throughput and memory of Me.chat without real API calls.")
+    parser.add_argument("--sessions", type = int, default = 50, help = "Conversations to replay")
+    parser.add_argument("--concurrency", type = int, default = 10, help = "Conversations in flight at once")
+    parser.add_argument("--conversations", default = os.path.join(BENCHMARKS, "conversations.json"), help = "JSON list of conversations, each a list of user messages")
+    parser.add_argument("--name", default = "Benchmark Persona", help = "Name the agent speaks as")
+    parser.add_argument("--first-token-latency", type = float, default = 0.3, help = "Seconds the fake model takes to its first token")
+    parser.add_argument("--token-interval", type = float, default = 0.01, help = "Seconds between streamed tokens")
+    parser.add_argument("--reply-tokens", type = int, default = 60, help = "Tokens per fake reply")
+    parser.add_argument("--reject-rate", type = float, default = 0.0, help = "Share of replies the fake evaluator rejects (0 to 1)")
+    parser.add_argument("--rate-limit-rate", type = float, default = 0.0, help = "Share of requests the fake API answers with a 429 (0 to 1)")
+    parser.add_argument("--push-latency", type = float, default = 0.05, help = "Seconds per fake Pushover request")
+    parser.add_argument("--json", default = None, help = "Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    ports = multiprocessing.get_context("spawn").Queue()
+    model_settings = {"first_token_latency" : args.first_token_latency, "token_interval" : args.token_interval,
+                      "reply_tokens" : args.reply_tokens, "reject_rate" : args.reject_rate, "rate_limit_rate" : args.rate_limit_rate}
+    servers = multiprocessing.get_context("spawn").Process(target = run_fake_servers, args = (model_settings, args.push_latency, ports), daemon = True)
+    servers.start()
+    openai_port, pushover_port = ports.get(timeout = 30)
+
+    # Point the app at the fake servers; the remaining settings can still be overridden from the environment
+    run_dir = tempfile.mkdtemp(prefix = "chatbot-benchmark-")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{openai_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ["PUSHOVER_URL"] = f"http://127.0.0.1:{pushover_port}/1/messages.json"
+    os.environ["PUSHOVER_USER"] = "benchmark"
+    os.environ["PUSHOVER_TOKEN"] = "benchmark"
+    os.environ["NOTIFY_SPOOL_DIR"] = os.path.join(run_dir, "spool")
+    os.environ["EVALUATION_STORE_PATH"] = os.path.join(run_dir, "evaluations.jsonl")
+    os.environ["LEAD_STORE_PATH"] = os.path.join(run_dir, "leads.sqlite3")
+    os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")  # Measure the pipeline, not the cache, unless asked to
+    sys.path.insert(0, ROOT)
+
+    try:
+        asyncio.run(main(args))
+    finally:
+        servers.terminate()
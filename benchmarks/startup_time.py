@@ -0,0 +1,46 @@
+# Import necessary libraries
+import argparse  # For the command line interface
+import json  # For reading the measurements of the child processes
+import os  # For interacting with the operating system
+import statistics  # For the median of the runs
+import subprocess  # For measuring each entry point in a fresh interpreter
+import sys  # For the path of the interpreter
+
+
+# The repository root, where the entry points live
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# What each entry point does before it can serve its first request (the persona itself is loaded the same way by both)
+scenarios = {
+    "headless server" : "import server; server.create_app()",
+    "gradio ui" : "import app; import gradio",
+}
+
+# Runs in the child: times the statement and reports the peak memory and whether gradio was loaded
+probe = """
+import json, resource, sys, time
+start = time.perf_counter()
+exec(compile(sys.argv[1], "<scenario>", "exec"))
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds" : seconds, "max_rss_kib" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, "gradio" : "gradio" in sys.modules}))
+"""
+
+
+# Function to measure one scenario in a fresh interpreter
+def measure(statement):
+    output = subprocess.run([sys.executable, "-c", probe, statement], cwd = ROOT, capture_output = True, text = True, check = True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+# Compares the cold start of the headless server with the Gradio UI: python benchmarks/startup_time.py --runs 5
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Measure the import time and memory of each entry point in fresh interpreters.")
+    parser.add_argument("--runs", type = int, default = 5, help = "Fresh interpreters per entry point (the median is reported)")
+    args = parser.parse_args()
+
+    for name, statement in scenarios.items():
+        runs = [measure(statement) for _ in range(args.runs)]
+        seconds = statistics.median(run["seconds"] for run in runs)
+        memory = statistics.median(run["max_rss_kib"] for run in runs)
+        print(f"{name:<16} {seconds * 1000:8.0f} ms   {memory / 1024:7.1f} MiB peak RSS   gradio loaded : {runs[0]['gradio']}")
@@ -0,0 +1,151 @@
+# Import necessary libraries
+import asyncio  # For writing verdicts without blocking the event loop
+import hashlib  # For the verdict cache keys
+import json  # For the verdict store
+import os  # For interacting with the operating system
+import random  # For sampling which replies are evaluated
+import threading  # For serializing appends to the verdict store
+import time  # For timestamping stored verdicts
+from collections import OrderedDict  # For the LRU verdict cache
+
+
+# Evaluation modes:
+# - "blocking": every reply is evaluated before it is shown, and a rejected reply is rerun within a retry budget
+# - "speculative": alternative candidates are generated and evaluated in parallel with the first reply, and the first
+#   acceptable one is shown (or the best one once the deadline has passed)
+# - "sampled": a share of the replies is evaluated in the background and the verdicts are stored
+# - "async": every reply is evaluated in the background and the verdicts are stored
+# - "off": replies are not evaluated
+EVALUATION_MODES = ("blocking", "speculative", "sampled", "async", "off")
+
+# Evaluator output formats:
+# - "schema": the API constrains the reply to the JSON schema of the verdict, with terse feedback and capped tokens
+# - "fenced": the evaluator is asked to enclose its JSON verdict in a ```json block (for models without structured output)
+EVALUATION_OUTPUTS = ("schema", "fenced")
+
+
+# Raised when the evaluator's reply cannot be read as a verdict; never cached, the reply is treated as acceptable
+class UnreadableEvaluation(ValueError):
+    pass
+
+
+# Least-recently-used cache of verdicts, keyed by a hash of the message and the reply
+class VerdictCache:
+    def __init__(self, max_size = 1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # Key -> verdict, least recently used first
+        self.lock = threading.Lock()
+
+
+    # Function to compute the key of a (message, reply) pair
+    @staticmethod
+    def key(message, reply):
+        return hashlib.sha256(f"{message}\x00{reply}".encode("utf-8")).hexdigest()
+
+
+    # Function to look up a verdict, or None
+    def get(self, key):
+        with self.lock:
+            verdict = self.entries.get(key)
+            if verdict is not None:
+                self.entries.move_to_end(key)
+            return verdict
+
+
+    # Function to store a verdict, evicting the least recently used one when full
+    def put(self, key, verdict):
+        with self.lock:
+            self.entries[key] = verdict
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last = False)
+
+
+# Append-only JSON Lines file of the verdicts of background evaluations
+class VerdictStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()  # Appends from several threads must not interleave
+
+
+    # Function to append one verdict record
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii = False) + "\n"
+        with self.lock:
+            with open(self.path, "a", encoding = "utf-8") as f:
+                f.write(line)
+
+
+# Decides whether, when and how replies are evaluated
+class EvaluationPolicy:
+    """
+    Settings come from the constructor or from EVALUATION_MODE, EVALUATION_SAMPLE_RATE (percent of replies evaluated
+    in "sampled" mode), EVALUATION_MAX_RERUNS (retry budget in "blocking" mode), EVALUATION_CANDIDATES and
+    EVALUATION_DEADLINE (replies generated per turn and seconds to find an acceptable one in "speculative" mode),
+    EVALUATION_OUTPUT and EVALUATION_MAX_TOKENS (format of the evaluator's reply and its token cap in "schema" output),
+    EVALUATION_CACHE_SIZE and EVALUATION_STORE_PATH (where background verdicts are logged).
+    """
+
+    def __init__(self, mode = None, sample_rate = None, max_reruns = None, cache_size = None, store_path = None, candidates = None, deadline = None,
+                 output = None, max_tokens = None):
+        self.mode = (mode or os.getenv("EVALUATION_MODE", "async")).strip().lower()
+        if self.mode not in EVALUATION_MODES:
+            raise ValueError(f"Unknown evaluation mode '{self.mode}', expected one of {EVALUATION_MODES}")
+        self.output = (output or os.getenv("EVALUATION_OUTPUT", "schema")).strip().lower()
+        if self.output not in EVALUATION_OUTPUTS:
+            raise ValueError(f"Unknown evaluation output '{self.output}', expected one of {EVALUATION_OUTPUTS}")
+
+        self.sample_rate = float(sample_rate if sample_rate is not None else os.getenv("EVALUATION_SAMPLE_RATE", "10")) / 100  # Share of replies
+        self.max_reruns = int(max_reruns if max_reruns is not None else os.getenv("EVALUATION_MAX_RERUNS", "1"))  # Reruns per turn
+        self.candidates = max(1, int(candidates if candidates is not None else os.getenv("EVALUATION_CANDIDATES", "3")))  # Replies per turn
+        self.deadline = float(deadline if deadline is not None else os.getenv("EVALUATION_DEADLINE", "8"))  # Seconds to find an acceptable one
+        self.max_tokens = int(max_tokens if max_tokens is not None else os.getenv("EVALUATION_MAX_TOKENS", "120"))  # Tokens per verdict
+        self.cache = VerdictCache(int(cache_size if cache_size is not None else os.getenv("EVALUATION_CACHE_SIZE", "1024")))
+        self.store = VerdictStore(store_path or os.getenv("EVALUATION_STORE_PATH", "evaluations.jsonl"))
+
+
+    # Function to tell whether replies must be held back until they have been evaluated
+    @property
+    def blocking(self):
+        return self.mode in ("blocking", "speculative")
+
+
+    # Function to tell whether alternative candidates are raced against the first reply
+    @property
+    def speculative(self):
+        return self.mode == "speculative"
+
+
+    # Function to decide whether a delivered reply gets a background evaluation
+    def should_evaluate_in_background(self):
+        if self.mode == "async":
+            return True
+        if self.mode == "sampled":
+            return random.random() < self.sample_rate
+        return False
+
+
+    # Function to evaluate a reply through the verdict cache, calling 'evaluate' (a coroutine function) on a miss
+    async def evaluate(self, evaluate, reply, message, history):
+        key = self.cache.key(message, reply)
+        verdict = self.cache.get(key)
+        if verdict is not None:
+            return verdict, True
+
+        verdict = await evaluate(reply, message, history)
+        self.cache.put(key, verdict)
+        return verdict, False
+
+
+    # Function to log the verdict of a background evaluation to the verdict store
+    async def record(self, reply, message, verdict, cached):
+        record = {
+            "time" : time.time(),  # When the verdict was reached
+            "mode" : self.mode,  # Policy that triggered the evaluation
+            "message" : message,  # The user's message
+            "reply" : reply,  # The reply that was evaluated
+            "is_acceptable" : verdict["is_acceptable"],  # The verdict
+            "feedback" : verdict["feedback"],  # The evaluator's feedback
+            "cached" : cached,  # Whether the verdict came from the cache
+        }
+        await asyncio.to_thread(self.store.append, record)
@@ -0,0 +1,131 @@
+# Import necessary libraries
+import hashlib  # For keying cached summaries by the turns they cover
+import logging  # For reporting failed summaries
+import threading  # For guarding the summary cache
+from collections import OrderedDict  # For the LRU summary cache
+from tokens import count_message_tokens  # For measuring the history against its budget
+
+
+# Logger of this module
+logger = logging.getLogger(__name__)
+
+
+# Function to reduce a Gradio history entry to the role and text the API accepts
+def clean_message(message):
+    content = message.get("content")
+    if not isinstance(content, str):
+        content = "" if content is None else str(content)  # Files and components are represented by their description
+    return {"role" : message.get("role", "user"), "content" : content}
+
+
+# Function to render messages as a plain transcript, e.g. for the evaluator or the summarizer
+def format_transcript(messages, summary = None):
+    lines = []
+    if summary:
+        lines.append(f"(Summary of the earlier conversation: {summary})")
+    for message in messages:
+        speaker = "User" if message["role"] == "user" else "Agent"
+        lines.append(f"{speaker}: {message['content']}")
+    return "\n".join(lines)
+
+
+# Keeps the history sent with each request within a token budget by folding older turns into a rolling summary
+class HistoryManager:
+    """
+    The most recent turns are kept verbatim as long as they fit in 'token_budget'. Older turns are folded into a
+    summary produced by 'summarize', a coroutine function taking (previous summary or None, messages to fold) and
+    returning the new summary.
+
+    Summaries are cached by the hash of the exact turns they cover, so each conversation effectively has its own
+    cache without needing a session id, and the summary of a longer prefix is built from the cached summary of a
+    shorter one plus the new turns only. When folding is needed, the history is folded down to half the budget, so a
+    summary is reused for the next few turns instead of being recomputed on each one.
+    """
+
+    def __init__(self, summarize, token_budget = 2000, cache_size = 1024):
+        self.summarize = summarize  # Coroutine function folding messages into a summary
+        self.token_budget = token_budget  # Maximum tokens of verbatim history per request
+        self.cache_size = cache_size  # Maximum number of summaries cached
+        self.summaries = OrderedDict()  # Hash of a history prefix -> summary of that prefix, least recently used first
+        self.lock = threading.Lock()
+
+
+    # Function to hash every prefix of a history: hashes[i] covers messages[:i]
+    @staticmethod
+    def prefix_hashes(messages):
+        digest = hashlib.sha256()
+        hashes = [digest.hexdigest()]
+        for message in messages:
+            digest.update(f"{message['role']}\x00{message['content']}\x01".encode("utf-8"))
+            hashes.append(digest.copy().hexdigest())
+        return hashes
+
+
+    # Function to find the start of the verbatim window that fits in 'budget', moved forward to a user turn
+    @staticmethod
+    def window_start(messages, sizes, budget):
+        start = len(messages)
+        used = 0
+        while start > 0 and used + sizes[start - 1] <= budget:
+            start = start - 1
+            used = used + sizes[start]
+        while start < len(messages) and messages[start]["role"] != "user":
+            start = start + 1  # Never start the window in the middle of a turn
+        return start
+
+
+    # Function to look up a cached summary
+    def cached_summary(self, key):
+        with self.lock:
+            summary = self.summaries.get(key)
+            if summary is not None:
+                self.summaries.move_to_end(key)
+            return summary
+
+
+    # Function to cache a summary, evicting the least recently used one when full
+    def cache_summary(self, key, summary):
+        with self.lock:
+            self.summaries[key] = summary
+            self.summaries.move_to_end(key)
+            while len(self.summaries) > self.cache_size:
+                self.summaries.popitem(last = False)
+
+
+    # Function to compact a history into (summary of the older turns or None, recent messages)
+    async def compact(self, history):
+        messages = [clean_message(message) for message in history]
+        sizes = [count_message_tokens(message) for message in messages]
+        if sum(sizes) <= self.token_budget:
+            return None, messages  # Everything fits, nothing to fold
+
+        hashes = self.prefix_hashes(messages)
+        minimum_start = self.window_start(messages, sizes, self.token_budget)
+
+        # The verbatim window starts at the latest turn at the latest (when it fits), so the reply the visitor is
+        # answering is never folded away, even when that turn alone is bigger than half the budget
+        latest_turn = max((index for index, message in enumerate(messages) if message["role"] == "user"), default = len(messages))
+        latest_start = max(minimum_start, latest_turn)
+
+        # Reuse a summary that already covers enough of the history for the rest to fit
+        for start in range(latest_start, minimum_start - 1, -1):
+            summary = self.cached_summary(hashes[start])
+            if summary is not None:
+                return summary, messages[start:]
+
+        # Fold down to half the budget, starting from the longest cached summary of a shorter prefix, if any
+        fold_to = min(latest_start, max(minimum_start, self.window_start(messages, sizes, self.token_budget // 2)))
+        previous, folded_from = None, 0
+        for start in range(fold_to - 1, 0, -1):
+            previous = self.cached_summary(hashes[start])
+            if previous is not None:
+                folded_from = start
+                break
+
+        try:
+            summary = await self.summarize(previous, messages[folded_from:fold_to])
+        except Exception as error:  # Without a summary the older turns are dropped, the turn itself still goes ahead
+            logger.warning("History summary failed -> %r", error)
+            return previous, messages[minimum_start:]
+        self.cache_summary(hashes[fold_to], summary)
+        return summary, messages[fold_to:]
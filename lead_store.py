@@ -0,0 +1,353 @@
+# Import necessary libraries
+import argparse  # For the export and query commands
+import atexit  # For writing what is queued when the process exits
+import csv  # For CSV exports
+import json  # For JSON Lines exports
+import logging  # For reporting failed writes
+import os  # For interacting with the operating system
+import queue  # For handing writes to the writer thread
+import re  # For expanding contractions
+import sqlite3  # For the store itself
+import sys  # For writing exports to standard output
+import threading  # For the writer thread and guarding the dedup index
+import time  # For timestamps and the flush interval
+from response_cache import normalize_message  # For the exact-match key of a question
+from retrieval import tokenize  # For the terms compared by the fuzzy match
+
+
+# Logger of this module
+logger = logging.getLogger(__name__)
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    persona TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    question TEXT NOT NULL,
+    terms TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    UNIQUE (persona, normalized)
+);
+CREATE TABLE IF NOT EXISTS leads (
+    id INTEGER PRIMARY KEY,
+    persona TEXT NOT NULL,
+    contact TEXT NOT NULL,
+    email TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mobile_no TEXT NOT NULL,
+    notes TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    UNIQUE (persona, contact)
+);
+CREATE INDEX IF NOT EXISTS questions_by_count ON questions (persona, count);
+CREATE INDEX IF NOT EXISTS leads_by_last_seen ON leads (persona, last_seen);
+"""
+
+# Upserts counting one occurrence, committed at once so that every process sharing the file decides on the same count
+count_question = """
+INSERT INTO questions (persona, normalized, question, terms, count, first_seen, last_seen) VALUES (?, ?, ?, ?, 1, ?, ?)
+ON CONFLICT (persona, normalized) DO UPDATE SET count = count + 1
+RETURNING count
+"""
+count_lead = """
+INSERT INTO leads (persona, contact, email, name, mobile_no, notes, count, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
+ON CONFLICT (persona, contact) DO UPDATE SET count = count + 1
+RETURNING count
+"""
+
+# Updates applied by the writer; a batch merges the occurrences of each key, so a burst of one question is one row update
+update_question = "UPDATE questions SET last_seen = max(last_seen, ?) WHERE persona = ? AND normalized = ?"
+update_lead = """
+UPDATE leads SET last_seen = max(last_seen, ?),
+    name = CASE WHEN ? = 'N/A' THEN name ELSE ? END,
+    mobile_no = CASE WHEN ? = 'N/A' THEN mobile_no ELSE ? END,
+    notes = CASE WHEN ? = 'N/A' THEN notes ELSE ? END
+WHERE persona = ? AND contact = ?
+"""
+
+
+# Function to open the database with the settings every connection needs
+def connect(path):
+    db = sqlite3.connect(path, timeout = 30, check_same_thread = False)
+    db.execute("PRAGMA journal_mode=WAL")  # Readers (e.g. the export command) never block the writer
+    db.execute("PRAGMA synchronous=NORMAL")  # Durable across process crashes, one fsync per checkpoint instead of per batch
+    db.executescript(schema)
+    return db
+
+
+# Contractions and their expansions, so "What's ..." and "What is ..." are the same question
+contractions = [(re.compile(pattern), expansion) for pattern, expansion in (
+    (r"\bcan[’']t\b", "cannot"), (r"\bwon[’']t\b", "will not"), (r"n[’']t\b", " not"), (r"[’']re\b", " are"),
+    (r"[’']ve\b", " have"), (r"[’']ll\b", " will"), (r"[’']d\b", " would"), (r"[’']m\b", " am"), (r"[’']s\b", " is"),
+)]
+
+
+# Function to normalize a question for the exact match, with its contractions expanded
+def normalize_question(question):
+    question = question.lower()
+    for pattern, expansion in contractions:
+        question = pattern.sub(expansion, question)
+    return normalize_message(question)
+
+
+# Function to get the terms a normalized question is fuzzily matched on (one-letter leftovers carry no meaning)
+def question_terms(normalized):
+    return frozenset(term for term in tokenize(normalized) if len(term) > 1)
+
+
+# Function to tell whether a lead field was filled in (the tool uses "N/A" for what the visitor did not share)
+def is_given(value):
+    return bool(value) and value.strip().upper() != "N/A"
+
+
+# Function to compute the key a lead is deduplicated by: the email when given, else the mobile number, else the name
+def contact_key(email, name, mobile_no):
+    if is_given(email):
+        return email.strip().lower()
+    if is_given(mobile_no):
+        return "mobile:" + "".join(character for character in mobile_no if character.isdigit() or character == "+")
+    if is_given(name):
+        return "name:" + normalize_message(name)
+    return "unknown"
+
+
+# Local SQLite store of leads and unknown questions, deduplicated so repeats only bump a counter
+class LeadStore:
+    """
+    Questions are matched first on their normalized text and then fuzzily: the one sharing the most terms is a repeat
+    when the Dice similarity of the two term sets (twice the shared terms over the terms of both) reaches 'similarity'.
+    Unlike Jaccard, it still matches a short question with one term added or left out at the default 0.8. Leads are
+    matched on their email (or mobile number, or name).
+
+    The terms index used by the fuzzy match is kept in memory and picks up the questions other processes added before
+    each match. The count of every occurrence is one upsert returning the new count, so processes sharing the file
+    (e.g. uvicorn --workers N) agree on first occurrences and threshold crossings; the last-seen times and lead details
+    are queued and applied by a background thread in batches of one transaction each.
+
+    Settings come from the constructor or from LEAD_STORE_PATH (default leads.sqlite3), LEAD_STORE_SIMILARITY
+    (default 0.8), LEAD_STORE_FLUSH_INTERVAL (seconds, default 1) and NOTIFY_THRESHOLDS (counts that trigger a
+    notification, default 1,10,100,1000).
+    """
+
+    def __init__(self, path = None, similarity = None, flush_interval = None, thresholds = None, batch_size = 500):
+        self.path = path or os.getenv("LEAD_STORE_PATH", "leads.sqlite3")
+        self.similarity = float(similarity if similarity is not None else os.getenv("LEAD_STORE_SIMILARITY", "0.8"))
+        self.flush_interval = float(flush_interval if flush_interval is not None else os.getenv("LEAD_STORE_FLUSH_INTERVAL", "1"))
+        self.thresholds = set(thresholds if thresholds is not None else (int(value) for value in os.getenv("NOTIFY_THRESHOLDS", "1,10,100,1000").split(",") if value.strip()))
+        self.batch_size = batch_size  # Writes per transaction at most
+
+        # Terms index: (persona, normalized) -> terms of each question, and (persona, term) -> normalized texts of the
+        # questions containing it, to find fuzzy candidates; filled from the database up to row 'last_question_id'
+        self.questions = {}
+        self.postings = {}
+        self.last_question_id = 0
+        self.lock = threading.Lock()
+
+        self.writes = queue.Queue()
+        self.stopping = threading.Event()
+        self.db = connect(self.path)  # Used by the writer thread
+        self.counter = connect(self.path)  # Used under the lock by the callers, for the counts
+        self.load_index()
+        self.writer = threading.Thread(target = self.run, name = "lead-store-writer", daemon = True)
+        self.writer.start()
+
+
+    # Function to add the questions stored since the last call (by any process) to the terms index; called under the lock
+    def load_index(self):
+        rows = self.counter.execute("SELECT id, persona, normalized, terms FROM questions WHERE id > ? ORDER BY id", (self.last_question_id,))
+        for question_id, persona, normalized, terms in rows:
+            self.index_question(persona, normalized, frozenset(term for term in terms.split() if len(term) > 1))
+            self.last_question_id = question_id
+
+
+    # Function to add a question to the terms index
+    def index_question(self, persona, normalized, terms):
+        self.questions[(persona, normalized)] = terms
+        for term in terms:
+            self.postings.setdefault((persona, term), set()).add(normalized)
+
+
+    # Function to find the already-stored question a new one repeats, returning its normalized text or None
+    def match_question(self, persona, normalized, terms):
+        if (persona, normalized) in self.questions:
+            return normalized
+        if not terms:
+            return None  # Nothing to compare beyond the exact text
+
+        overlaps = {}
+        for term in terms:
+            for candidate in self.postings.get((persona, term), ()):
+                overlaps[candidate] = overlaps.get(candidate, 0) + 1
+
+        best, best_similarity = None, 0.0
+        for candidate, overlap in overlaps.items():
+            candidate_terms = self.questions[(persona, candidate)]
+            similarity = 2 * overlap / (len(terms) + len(candidate_terms))
+            if similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        return best if best_similarity >= self.similarity else None
+
+
+    # Function to record an unknown question, returning how many times it (or a near-identical one) has been asked
+    def record_question(self, persona, question):
+        normalized = normalize_question(question)
+        terms = question_terms(normalized)
+        now = time.time()
+        with self.lock:
+            self.load_index()
+            match = self.match_question(persona, normalized, terms)
+            if match is None:
+                self.index_question(persona, normalized, terms)
+            else:
+                normalized = match
+            with self.counter:
+                count = self.counter.execute(count_question, (persona, normalized, question, " ".join(sorted(terms)), now, now)).fetchone()[0]
+        self.writes.put(("question", (persona, normalized), (now,)))
+        return count
+
+
+    # Function to record a lead, returning how many times this contact has been recorded
+    def record_lead(self, persona, email = "N/A", name = "N/A", mobile_no = "N/A", notes = "N/A"):
+        contact = contact_key(email, name, mobile_no)
+        now = time.time()
+        with self.lock, self.counter:
+            count = self.counter.execute(count_lead, (persona, contact, email, name, mobile_no, notes, now, now)).fetchone()[0]
+        self.writes.put(("lead", (persona, contact), (email, name, mobile_no, notes, now)))
+        return count
+
+
+    # Function to tell whether an occurrence count deserves a notification (the first one, then each threshold)
+    def should_notify(self, count):
+        return count in self.thresholds
+
+
+    # Function to apply a batch of writes in one transaction, merging repeats of the same key
+    def apply(self, batch):
+        questions, leads = {}, {}
+        for kind, key, values in batch:
+            pending = questions if kind == "question" else leads
+            entry = pending.get(key)
+            if entry is None:
+                pending[key] = [values[:-1], values[-1]]  # Details, last time seen
+            else:
+                entry[1] = max(entry[1], values[-1])
+                # The latest contact details win where given; a question keeps its first wording
+                entry[0] = tuple(new if is_given(new) else old for old, new in zip(entry[0], values[:-1]))
+
+        with self.db:
+            self.db.executemany(update_question, [
+                (last_seen, persona, normalized) for (persona, normalized), (_, last_seen) in questions.items()
+            ])
+            self.db.executemany(update_lead, [
+                (last_seen, name, name, mobile_no, mobile_no, notes, notes, persona, contact)
+                for (persona, contact), ((email, name, mobile_no, notes), last_seen) in leads.items()
+            ])
+
+
+    # Writer loop: wait for a write, collect whatever else arrives within the flush interval, and apply it all at once
+    def run(self):
+        while not (self.stopping.is_set() and self.writes.empty()):
+            try:
+                batch = [self.writes.get(timeout = 0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.writes.get(timeout = max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self.apply(batch)
+            except sqlite3.Error as error:
+                logger.error("Could not write %s lead store records -> %r", len(batch), error)
+
+
+    # Function to write everything queued and stop the writer
+    def close(self, timeout = 10.0):
+        self.stopping.set()
+        self.writer.join(timeout)
+        self.db.close()
+        self.counter.close()
+
+
+# One store per process, created on first use and shared by every persona
+_lead_store = None
+_lead_store_lock = threading.Lock()
+
+
+# Function to get the process-wide lead store
+def get_lead_store():
+    global _lead_store
+    with _lead_store_lock:
+        if _lead_store is None:
+            _lead_store = LeadStore()
+            atexit.register(_lead_store.close)  # The writer is a daemon thread, so flush it on the way out
+        return _lead_store
+
+
+# Function to run a query of the export commands, returning (column names, rows)
+def query(path, table, persona = None, min_count = 1, since = None, limit = None):
+    columns = {
+        "questions" : ["persona", "question", "count", "first_seen", "last_seen"],
+        "leads" : ["persona", "email", "name", "mobile_no", "notes", "count", "first_seen", "last_seen"],
+    }[table]
+    sql = f"SELECT {', '.join(columns)} FROM {table} WHERE count >= ?"
+    parameters = [min_count]
+    if persona:
+        sql = sql + " AND persona = ?"
+        parameters.append(persona)
+    if since is not None:
+        sql = sql + " AND last_seen >= ?"
+        parameters.append(since)
+    sql = sql + (" ORDER BY count DESC, last_seen DESC" if table == "questions" else " ORDER BY last_seen DESC")
+    if limit:
+        sql = sql + " LIMIT ?"
+        parameters.append(limit)
+
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri = True)  # Read-only, alongside the running app
+    try:
+        return columns, db.execute(sql, parameters).fetchall()
+    finally:
+        db.close()
+
+
+# Query or export the store: python lead_store.py questions --min-count 5 | python lead_store.py leads --format csv -o leads.csv
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Query and export the recorded leads and unknown questions.")
+    parser.add_argument("table", choices = ["questions", "leads"])
+    parser.add_argument("--path", default = os.getenv("LEAD_STORE_PATH", "leads.sqlite3"), help = "The store (default: LEAD_STORE_PATH or leads.sqlite3)")
+    parser.add_argument("--persona", default = None, help = "Only this persona")
+    parser.add_argument("--min-count", type = int, default = 1, help = "Only entries recorded at least this many times")
+    parser.add_argument("--days", type = float, default = None, help = "Only entries seen in the last N days")
+    parser.add_argument("--limit", type = int, default = None)
+    parser.add_argument("--format", choices = ["table", "csv", "jsonl"], default = "table")
+    parser.add_argument("-o", "--output", default = None, help = "File to write (default: standard output)")
+    args = parser.parse_args()
+
+    since = time.time() - args.days * 86400 if args.days is not None else None
+    columns, rows = query(args.path, args.table, args.persona, args.min_count, since, args.limit)
+
+    output = open(args.output, "w", encoding = "utf-8", newline = "") if args.output else sys.stdout
+    try:
+        if args.format == "csv":
+            writer = csv.writer(output)
+            writer.writerow(columns)
+            writer.writerows(rows)
+        elif args.format == "jsonl":
+            for row in rows:
+                output.write(json.dumps(dict(zip(columns, row)), ensure_ascii = False) + "\n")
+        else:
+            for row in rows:
+                record = dict(zip(columns, row))
+                seen = time.strftime("%Y-%m-%d %H:%M", time.localtime(record["last_seen"]))
+                details = record["question"] if args.table == "questions" else f"{record['name']} <{record['email']}> {record['mobile_no']} - {record['notes']}"
+                output.write(f"{record['count']:6d}  {seen}  [{record['persona']}] {details}\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
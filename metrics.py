@@ -0,0 +1,210 @@
+# Import necessary libraries
+import asyncio  # For telling cancelled stages from failed ones
+import bisect  # For finding the histogram bucket of an observation
+import json  # For the JSON metrics log
+import logging  # For the application log and the metrics log
+import logging.handlers  # For writing the metrics log from a background thread
+import os  # For interacting with the operating system
+import queue  # For handing log records to the background writer
+import threading  # For guarding the metric values and serving the endpoint
+import time  # For timing stages
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # For the Prometheus endpoint
+
+
+# Logger of the per-stage metric events, one JSON object per line
+metrics_logger = logging.getLogger("portfolio_chatbot.metrics")
+
+# Bucket upper bounds for durations (seconds) and token counts
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+ITERATION_BUCKETS = (1, 2, 3, 4, 5, 8)
+
+
+# Function to render a label set in the Prometheus text format
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+# Cumulative histogram, one series per label set
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)  # Upper bounds, ascending; +Inf is implicit
+        self.series = {}  # Sorted label tuple -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+
+    # Function to record one observation
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+
+    # Function to render the histogram in the Prometheus text format
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {series[-1]}")
+                lines.append(f"{self.name}_count{format_labels(key)} {cumulative}")
+        return lines
+
+
+# Monotonic counter, one series per label set
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}  # Sorted label tuple -> value
+        self.lock = threading.Lock()
+
+
+    # Function to increase the counter
+    def inc(self, amount = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+
+    # Function to render the counter in the Prometheus text format
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.series.items()):
+                lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+
+# The metrics of the process
+stage_seconds = Histogram("chatbot_stage_seconds", "Wall time of each pipeline stage (chat_completion, tool_calls, evaluate, rerun, push, ...).", SECONDS_BUCKETS)
+first_token_seconds = Histogram("chatbot_first_token_seconds", "Time from the start of a streamed completion to its first content token.", SECONDS_BUCKETS)
+stage_tokens = Histogram("chatbot_stage_tokens", "Tokens per LLM call, by stage and kind (prompt, completion, cached).", TOKEN_BUCKETS)
+turn_iterations = Histogram("chatbot_turn_iterations", "LLM calls in the tool loop of one chat turn.", ITERATION_BUCKETS)
+tokens_total = Counter("chatbot_tokens_total", "Tokens used, by stage and kind (prompt, completion, cached).")
+events_total = Counter("chatbot_events_total", "Pipeline events, e.g. response cache hits and misses or failed stages.")
+all_metrics = (stage_seconds, first_token_seconds, stage_tokens, turn_iterations, tokens_total, events_total)
+
+
+# Function to render every metric in the Prometheus text format
+def render_metrics():
+    lines = []
+    for metric in all_metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Function to record a finished stage: its duration, the token usage of its LLM call (if any) and extra fields for the log
+def record_stage(stage, seconds, usage = None, **fields):
+    stage_seconds.observe(seconds, stage = stage)
+    event = {"time" : time.time(), "stage" : stage, "seconds" : round(seconds, 6), **fields}
+
+    if usage is not None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        counts = {
+            "prompt" : usage.prompt_tokens or 0,
+            "completion" : usage.completion_tokens or 0,
+            "cached" : (getattr(details, "cached_tokens", None) or 0) if details is not None else 0,
+        }
+        for kind, count in counts.items():
+            stage_tokens.observe(count, stage = stage, kind = kind)
+            tokens_total.inc(count, stage = stage, kind = kind)
+            event[f"{kind}_tokens"] = count
+
+    if metrics_logger.isEnabledFor(logging.INFO):
+        metrics_logger.info(json.dumps(event, default = str))
+
+
+# Function to count an event, e.g. count_event("response_cache", result = "hit")
+def count_event(event, **labels):
+    events_total.inc(event = event, **labels)
+
+
+# Times a stage: 'with StageTimer("tool_calls", calls = 2) as timer:' records the stage when the block ends
+class StageTimer:
+    def __init__(self, stage, **fields):
+        self.stage = stage
+        self.fields = fields  # Extra fields for the log; more can be added to timer.fields inside the block
+        self.usage = None  # Set inside the block to record the token usage of the stage's LLM call
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, error_type, error, traceback):
+        if error_type is not None and issubclass(error_type, asyncio.CancelledError):
+            self.fields["cancelled"] = True  # E.g. a speculative candidate that lost the race, not a failure
+        elif error_type is not None and not issubclass(error_type, GeneratorExit):
+            self.fields["error"] = error_type.__name__
+            count_event("stage_failed", stage = self.stage)
+        record_stage(self.stage, time.perf_counter() - self.start, self.usage, **self.fields)
+        return False
+
+
+# Serves the metrics on GET /metrics
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a log line
+
+
+# Function to start the Prometheus endpoint in a background thread, returning the server (or None when disabled or unavailable)
+def serve_metrics(port = None, host = None):
+    port = int(port if port is not None else os.getenv("METRICS_PORT", "9464"))
+    if port <= 0:
+        return None
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")  # Local only unless exposed on purpose
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as error:  # E.g. the port is taken by another instance; the chat itself does not need the endpoint
+        logging.getLogger(__name__).warning("Metrics endpoint not started, cannot listen on %s:%s -> %r", host, port, error)
+        return None
+    threading.Thread(target = server.serve_forever, name = "metrics-endpoint", daemon = True).start()
+    logging.getLogger(__name__).info("Serving metrics on %s:%s", host, server.server_port)
+    return server
+
+
+# Function to configure the application log level and the JSON metrics log
+def configure_logging():
+    """
+    LOG_LEVEL sets the level of the application log (default WARNING, so the per-turn debug output costs nothing).
+    METRICS_LOG_PATH names the file the JSON metric events are appended to (default metrics.jsonl, empty to disable);
+    the file is written by a background thread so the chat never waits on the disk.
+    """
+    logging.basicConfig(level = os.getenv("LOG_LEVEL", "WARNING").upper(), format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    log_path = os.getenv("METRICS_LOG_PATH", "metrics.jsonl")
+    if not log_path or metrics_logger.handlers:
+        return
+
+    log_queue = queue.SimpleQueue()
+    file_handler = logging.FileHandler(log_path, encoding = "utf-8")
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.handlers.QueueListener(log_queue, file_handler).start()
+    metrics_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    metrics_logger.setLevel(logging.INFO)
+    metrics_logger.propagate = False  # Keep the JSON events out of the application log
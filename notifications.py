@@ -0,0 +1,354 @@
+# Import necessary libraries
+import json  # For writing events to the spool
+import logging  # For reporting deliveries and failures
+import os  # For interacting with the operating system
+import queue  # For the bounded in-process event queue
+import random  # For jittering retry delays
+import threading  # For the background delivery worker
+import time  # For digest windows and retry delays
+import uuid  # For naming spooled events
+try:
+    import fcntl  # For the lock marking a spool subdirectory as owned by a running dispatcher
+except ImportError:  # Windows: ownership falls back to whether the process named by the subdirectory is running
+    fcntl = None
+from metrics import StageTimer  # For the latency of each delivery attempt
+
+
+# Logger of this module
+logger = logging.getLogger(__name__)
+
+
+# Default Pushover endpoint; PUSHOVER_URL points the dispatcher elsewhere, e.g. at a local stub server in tests
+DEFAULT_PUSHOVER_URL = "https://api.pushover.net/1/messages.json"
+
+# Pushover rejects messages longer than this many characters
+MAX_MESSAGE_LENGTH = 1024
+
+# File in each worker subdirectory of the spool that its dispatcher keeps locked while it runs
+LOCK_FILE_NAME = ".lock"
+
+
+# Delivers notifications from a background thread so that the chat turn never waits on Pushover
+class NotificationDispatcher:
+    """
+    notify() writes the event to a spool directory and puts it on a bounded queue, then returns immediately.
+    A single worker thread takes events off the queue and posts them through one pooled requests.Session, retrying
+    with exponential backoff. Events of kind "unknown_question" are held for a short window and sent together as one
+    digest, so a burst of unanswered questions costs one push instead of one each. A spooled event is only deleted
+    once it has been delivered; whatever is left in the spool when the process stops is sent after the next start.
+
+    Each dispatcher spools into its own subdirectory ("worker-<pid>-<id>") of the spool directory, so the worker
+    processes of one server never send each other's events. A dispatcher holds an exclusive lock on the lock file of
+    its subdirectory for as long as it runs; any subdirectory whose lock can be taken belongs to a dispatcher that has
+    stopped (even one whose process id has since been reused, as it usually is after a container restart), and its
+    events are claimed by moving them into the claiming dispatcher's own subdirectory, which only one can succeed at.
+    """
+
+    def __init__(self, url = None, user = None, token = None, spool_dir = None, queue_size = None, digest_window = None,
+                 max_attempts = None, timeout = 10.0, rescan_delay = 15.0):
+        self.url = url or os.getenv("PUSHOVER_URL", DEFAULT_PUSHOVER_URL)  # Endpoint the notifications are posted to
+        self.user = user or os.getenv("PUSHOVER_USER")  # The Pushover user key
+        self.token = token or os.getenv("PUSHOVER_TOKEN")  # The Pushover API token
+        self.spool_root = spool_dir or os.getenv("NOTIFY_SPOOL_DIR", ".notification_spool")  # Where undelivered events are kept
+        self.digest_window = float(digest_window if digest_window is not None else os.getenv("NOTIFY_DIGEST_WINDOW", "30"))  # Seconds to collect questions
+        self.max_attempts = int(max_attempts if max_attempts is not None else os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))  # Tries per delivery
+        self.timeout = timeout  # Seconds before a request to the endpoint is abandoned
+        self.rescan_delay = rescan_delay  # Seconds before the spool is rescanned after a failed delivery, doubled up to 5 minutes
+
+        self.queue = queue.Queue(maxsize = int(queue_size if queue_size is not None else os.getenv("NOTIFY_QUEUE_SIZE", "1000")))
+        self.overflowed = threading.Event()  # Set when an event could only be spooled, so the worker rescans the spool
+        self.stopping = threading.Event()  # Set by close() to stop the worker
+        self.session = None  # Created by the worker on first delivery
+        self.worker = None  # Started by start()
+        self.lock = threading.Lock()  # Guards start()
+        self.spool_dir, self.spool_lock = self.own_spool()  # This dispatcher's share of the spool, and the lock held on it
+
+
+    # Function to create this dispatcher's subdirectory of the spool, locked before other dispatchers can see it
+    def own_spool(self):
+        name = f"worker-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        staging_dir = os.path.join(self.spool_root, "." + name)
+        os.makedirs(staging_dir)
+        spool_lock = None
+        if fcntl is not None:
+            spool_lock = open(os.path.join(staging_dir, LOCK_FILE_NAME), "w")
+            fcntl.flock(spool_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)  # A new file, nobody else can hold it
+        spool_dir = os.path.join(self.spool_root, name)
+        os.rename(staging_dir, spool_dir)
+        return spool_dir, spool_lock
+
+
+    # Function to start the worker thread (idempotent), queueing whatever an earlier process left in the spool
+    def start(self):
+        with self.lock:
+            if self.worker is not None:
+                return self
+            self.requeue_spool()
+            self.worker = threading.Thread(target = self.run, name = "notification-dispatcher", daemon = True)
+            self.worker.start()
+        return self
+
+
+    # Function to queue a notification without waiting for its delivery
+    def notify(self, message, kind = "message"):
+        """
+        'kind' is "unknown_question" for questions to coalesce into digests; anything else is sent on its own.
+        Returns True when the event was queued, False when the queue was full (the event is then only spooled and is
+        picked up once the queue drains).
+        """
+        self.start()
+        event = {"id" : f"{time.time():.6f}-{uuid.uuid4().hex}", "kind" : kind, "message" : str(message), "created" : time.time()}
+
+        # Spool first, so the event survives a restart even if it is never taken off the queue
+        with open(self.spool_path(event["id"]), "w", encoding = "utf-8") as f:
+            json.dump(event, f)
+
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            logger.warning("Notification queue full, event %s left in the spool", event["id"])
+            self.overflowed.set()
+            return False
+        return True
+
+
+    # Function to stop the worker after sending any pending digest (undelivered events stay in the spool)
+    def close(self, timeout = 10.0):
+        self.stopping.set()
+        if self.worker is not None:
+            self.worker.join(timeout)
+        if not any(file_name.endswith(".json") for file_name in os.listdir(self.spool_dir)):
+            remove_spool_dir(self.spool_dir)  # Everything was delivered
+        if self.spool_lock is not None:
+            self.spool_lock.close()  # Whatever is left can now be claimed by another dispatcher
+
+
+    # Function to get the spool file of an event
+    def spool_path(self, event_id):
+        return os.path.join(self.spool_dir, f"{event_id}.json")
+
+
+    # Function to move the events of dispatchers whose process has stopped into this dispatcher's spool
+    def claim_orphans(self):
+        self.claim_events(self.spool_root)  # Events spooled directly in the spool directory by older versions
+        for name in os.listdir(self.spool_root):
+            path = os.path.join(self.spool_root, name)
+            if not name.startswith("worker-") or path == self.spool_dir or not os.path.isdir(path):
+                continue
+            lock = take_over(path, name)
+            if lock is None:
+                continue  # Its dispatcher is running
+            try:
+                self.claim_events(path)
+                remove_spool_dir(path)
+            finally:
+                if lock is not True:
+                    lock.close()
+
+
+    # Function to move the events of a directory into this dispatcher's spool
+    def claim_events(self, directory):
+        try:
+            file_names = os.listdir(directory)
+        except OSError:
+            return  # Removed by another claimer meanwhile
+        for file_name in file_names:
+            if file_name.endswith(".json"):
+                try:
+                    os.rename(os.path.join(directory, file_name), os.path.join(self.spool_dir, file_name))  # Atomic, one claimer wins
+                except OSError:
+                    pass  # Claimed by another dispatcher first
+
+
+    # Function to put the spooled events back on the queue, oldest first
+    def requeue_spool(self):
+        self.claim_orphans()
+        for file_name in sorted(os.listdir(self.spool_dir)):
+            if not file_name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, file_name), "r", encoding = "utf-8") as f:
+                    event = json.load(f)
+                self.queue.put_nowait(event)
+            except ValueError:
+                logger.warning("Discarding unreadable spooled notification %s", file_name)
+                os.remove(os.path.join(self.spool_dir, file_name))
+            except queue.Full:
+                self.overflowed.set()  # Try the rest once the queue has drained
+                return
+            except OSError:
+                continue  # Delivered and removed meanwhile
+
+
+    # Worker loop: deliver single events straight away and unknown questions as digests
+    def run(self):
+        pending_questions = []  # Events waiting to be sent in the next digest
+        digest_deadline = None  # When the current digest is due
+        retry_delay = None  # Current delay before rescanning the spool, while deliveries fail
+        rescan_at = None  # When the events whose delivery failed are queued again
+
+        while not (self.stopping.is_set() and self.queue.empty()):
+            # Wait for the next event, but not past the digest deadline
+            wait = 0.5 if digest_deadline is None else max(0.0, min(0.5, digest_deadline - time.monotonic()))
+            try:
+                event = self.queue.get(timeout = wait)
+            except queue.Empty:
+                event = None
+
+            # An event can be queued twice when the spool is rescanned; its spool file is gone once it has been delivered
+            if event is not None and os.path.exists(self.spool_path(event["id"])) and all(event["id"] != pending["id"] for pending in pending_questions):
+                if event["kind"] == "unknown_question":
+                    pending_questions.append(event)
+                    digest_deadline = digest_deadline or time.monotonic() + self.digest_window
+                elif self.deliver([event], event["message"]):
+                    retry_delay = None
+                else:
+                    retry_delay = self.rescan_delay if retry_delay is None else min(300.0, retry_delay * 2)
+                    rescan_at = time.monotonic() + retry_delay  # The event stays in the spool, try it again later
+
+            # Send the digest when its window has passed, or right away when stopping; keep it until it is delivered
+            if pending_questions and (time.monotonic() >= digest_deadline or self.stopping.is_set()):
+                if self.deliver(pending_questions, self.digest_message(pending_questions)):
+                    pending_questions, digest_deadline, retry_delay = [], None, None
+                else:
+                    retry_delay = self.rescan_delay if retry_delay is None else min(300.0, retry_delay * 2)
+                    digest_deadline = time.monotonic() + retry_delay
+
+            # Pick up events that overflowed the queue once it has room again, or whose delivery failed once the delay is over
+            if (self.overflowed.is_set() or (rescan_at is not None and time.monotonic() >= rescan_at)) and self.queue.empty():
+                self.overflowed.clear()
+                rescan_at = None
+                self.requeue_spool()
+
+        if pending_questions:
+            self.deliver(pending_questions, self.digest_message(pending_questions))
+
+
+    # Function to build one message out of several unknown questions
+    def digest_message(self, events):
+        if len(events) == 1:
+            return f"Recording {events[0]['message']} asked that I couldn't answer"
+
+        header = f"{len(events)} questions asked that I couldn't answer:"
+        lines = [header]
+        length = len(header)
+        for index, event in enumerate(events):
+            line = f"- {event['message']}"
+            remainder = f"... and {len(events) - index} more"
+            if length + len(line) + len(remainder) + 2 > MAX_MESSAGE_LENGTH:
+                lines.append(remainder)  # Pushover truncates long messages, say how many were left out instead
+                break
+            lines.append(line)
+            length = length + len(line) + 1
+        return "\n".join(lines)
+
+
+    # Function to post a message with retries, removing its events from the spool once it has been delivered
+    def deliver(self, events, message):
+        if self.session is None:
+            import requests  # Imported here, as only the worker thread makes HTTP requests
+            self.session = requests.Session()  # One session, so the connection to the endpoint is reused
+            self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = 2))
+            self.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = 2))
+
+        # Create the payload for the Pushover API request
+        payload = {
+            "user" : self.user,  # The Pushover user key
+            "token" : self.token,  # The Pushover API token
+            "message" : message  # The message content to be sent
+        }
+        logger.debug("Push : %s", message)
+
+        for attempt in range(self.max_attempts):
+            retry_after = None
+            try:
+                with StageTimer("push", attempt = attempt + 1, events = len(events)):
+                    response = self.session.post(self.url, data = payload, timeout = self.timeout)
+                if response.status_code < 400:
+                    break  # Delivered
+                if response.status_code != 429 and response.status_code < 500:
+                    logger.error("Push rejected with status %s -> %s", response.status_code, response.text[:200])
+                    break  # The request itself is wrong, retrying will not help
+                retry_after = response.headers.get("Retry-After")
+                logger.warning("Push failed with status %s (attempt %s)", response.status_code, attempt + 1)
+            except Exception as error:  # Connection errors and timeouts
+                logger.warning("Push failed -> %r (attempt %s)", error, attempt + 1)
+
+            if attempt + 1 == self.max_attempts:
+                logger.error("Giving up on push after %s attempts, events stay in the spool", self.max_attempts)
+                return False
+
+            # Exponential backoff with jitter, or the delay the endpoint asked for
+            delay = min(60.0, 2 ** attempt) * random.uniform(0.5, 1.5)
+            if retry_after is not None:
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    pass
+            if self.stopping.wait(delay):
+                return False  # Shutting down; the events stay in the spool for the next start
+
+        for event in events:
+            try:
+                os.remove(self.spool_path(event["id"]))
+            except OSError:
+                pass
+        return True
+
+
+# Function to take over the spool subdirectory of a stopped dispatcher, returning the lock taken on it (True without
+# fcntl), or None while its dispatcher is running
+def take_over(path, name):
+    if fcntl is None:
+        pid = name.split("-")[1]
+        return True if pid == str(os.getpid()) or not process_alive(pid) else None  # Our own id: a previous process had it
+    try:
+        lock = open(os.path.join(path, LOCK_FILE_NAME), "a")
+    except OSError:
+        return None  # Removed meanwhile by another claimer
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:  # Held by its running dispatcher
+        lock.close()
+        return None
+    return lock
+
+
+# Function to remove an emptied spool subdirectory and its lock file
+def remove_spool_dir(path):
+    try:
+        os.remove(os.path.join(path, LOCK_FILE_NAME))
+    except OSError:
+        pass  # No lock file (Windows) or already removed
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass  # Not empty yet or already removed
+
+
+# Function to tell whether the process with a given id (as found in a spool subdirectory name) is still running
+def process_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ValueError:
+        return True  # Not a name this module wrote, leave it alone
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Running, under another user
+    return True
+
+
+# One dispatcher per process, shared by every conversation
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+# Function to get the process-wide notification dispatcher, creating and starting it on first use, so whatever an
+# earlier process left in the spool is sent right away instead of waiting for the next notification
+def get_notification_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher().start()
+        return _dispatcher
@@ -0,0 +1,167 @@
+# Import necessary libraries
+import asyncio  # For loading profiles without blocking the event loop
+import json  # For reading the persona settings
+import logging  # For reporting loads and evictions
+import os  # For interacting with the operating system
+import re  # For validating persona names taken from requests
+import threading  # For guarding the loaded personas
+import time  # For spacing out memory measurements
+from collections import OrderedDict  # For the LRU order of the loaded personas
+
+
+# Logger of this module
+logger = logging.getLogger(__name__)
+
+
+# Files every persona directory has, the same shape as me/
+LINKEDIN_FILE_NAME = "personal_linkedIn.pdf"
+SUMMARY_FILE_NAME = "summary.txt"
+
+# Optional settings of a persona, e.g. {"name" : "Jane Doe"}
+SETTINGS_FILE_NAME = "persona.json"
+
+# Header that selects the persona of a request
+PERSONA_HEADER = "x-persona"
+
+# Persona names are directory names taken from requests, so they are restricted to a safe alphabet
+persona_pattern = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+
+# Function to read the display name of a persona from its persona.json, falling back to its directory name
+def persona_name(directory, slug):
+    try:
+        with open(os.path.join(directory, SETTINGS_FILE_NAME), "r", encoding = "utf-8") as f:
+            name = json.load(f).get("name")
+        if name:
+            return name
+    except (OSError, ValueError, AttributeError):
+        pass  # No or unreadable settings
+    return slug.replace("-", " ").replace("_", " ").title()
+
+
+# Serves many personas from one process: each is a directory shaped like me/ under a common root
+class PersonaRegistry:
+    """
+    A persona is loaded on first use by 'factory', called as factory(name, linkedIn_path, summary_path) and returning
+    the object that answers its chats (a Me). Loaded personas are kept in least-recently-used order and evicted once
+    the estimated memory of all of them exceeds 'memory_cap' bytes; the persona just loaded or used is never evicted.
+    A persona's caches (replies, history summaries) grow as it is used, so its estimate is refreshed when it is used,
+    at most every 'measure_interval' seconds, and every estimate is refreshed before a load decides what to evict.
+    Everything the personas share (the API client and its connection pool, the notification pipeline) is shared by
+    the factory, so a persona only costs its profile, prompts, index and caches.
+
+    Settings come from the constructor or from PERSONAS_DIR (root of the persona directories, default the current
+    directory, so me/ is the persona "me"), DEFAULT_PERSONA (used when a request names none, default "me") and
+    PERSONAS_MEMORY_MB (default 256).
+    """
+
+    def __init__(self, factory, root = None, default = None, memory_cap = None, measure_interval = 5.0):
+        self.factory = factory
+        self.root = root or os.getenv("PERSONAS_DIR", ".")
+        self.default = default or os.getenv("DEFAULT_PERSONA", "me")
+        self.memory_cap = int(memory_cap if memory_cap is not None else float(os.getenv("PERSONAS_MEMORY_MB", "256")) * 1024 * 1024)
+        self.measure_interval = measure_interval  # Seconds between two measurements of a persona in use
+        self.loaded = OrderedDict()  # Persona -> [object, estimated bytes, when estimated], least recently used first
+        self.memory = 0  # Estimated bytes of all loaded personas
+        self.lock = threading.Lock()  # Guards 'loaded' and 'memory'
+        self.load_lock = threading.Lock()  # One load at a time, so a persona requested twice at once is loaded once
+
+
+    # Function to get the directory of a persona, or None when there is no such persona
+    def directory(self, slug):
+        if not slug or not persona_pattern.match(slug):
+            return None
+        directory = os.path.join(self.root, slug)
+        if os.path.isfile(os.path.join(directory, LINKEDIN_FILE_NAME)) and os.path.isfile(os.path.join(directory, SUMMARY_FILE_NAME)):
+            return directory
+        return None
+
+
+    # Function to list the personas available under the root
+    def available(self):
+        try:
+            entries = sorted(os.listdir(self.root))
+        except OSError:
+            return []
+        return [entry for entry in entries if self.directory(entry) is not None]
+
+
+    # Function to pick the persona of a request: the X-Persona header, else the first segment of the URL path, else the default
+    def resolve(self, path = None, headers = None):
+        for name, value in (headers or {}).items():
+            if name.lower() == PERSONA_HEADER and value:
+                return value.strip()
+        segments = [segment for segment in (path or "").split("/") if segment]
+        if segments and self.directory(segments[0]) is not None:
+            return segments[0]
+        return self.default
+
+
+    # Function to refresh the memory estimate of a loaded persona (called with the lock held)
+    def measure(self, entry):
+        size = entry[0].memory_estimate()
+        self.memory = self.memory + size - entry[1]
+        entry[1], entry[2] = size, time.monotonic()
+
+
+    # Function to unload the least recently used personas until the rest fit in the cap (called with the lock held)
+    def evict(self):
+        while self.memory > self.memory_cap and len(self.loaded) > 1:
+            evicted, (_, evicted_size, _) = self.loaded.popitem(last = False)
+            self.memory = self.memory - evicted_size
+            logger.info("Evicted persona %s (%s bytes)", evicted, evicted_size)
+
+
+    # Function to get a loaded persona, or None
+    def cached(self, slug):
+        with self.lock:
+            entry = self.loaded.get(slug)
+            if entry is None:
+                return None
+            self.loaded.move_to_end(slug)
+            if time.monotonic() - entry[2] >= self.measure_interval:
+                self.measure(entry)  # Its caches may have grown since
+                self.evict()
+            return entry[0]
+
+
+    # Function to get a persona, loading it on first use (raises KeyError for an unknown persona)
+    def get(self, slug = None):
+        slug = slug or self.default
+        persona = self.cached(slug)
+        if persona is not None:
+            return persona
+
+        with self.load_lock:
+            persona = self.cached(slug)  # Loaded by another thread while this one waited
+            if persona is not None:
+                return persona
+
+            directory = self.directory(slug)
+            if directory is None:
+                raise KeyError(f"Unknown persona '{slug}'")
+            persona = self.factory(persona_name(directory, slug), os.path.join(directory, LINKEDIN_FILE_NAME), os.path.join(directory, SUMMARY_FILE_NAME))
+            entry = [persona, 0, 0.0]
+
+            with self.lock:
+                for loaded in self.loaded.values():
+                    self.measure(loaded)  # Decide what to evict from what the personas use now, not when they were loaded
+                self.loaded[slug] = entry
+                self.measure(entry)
+                self.evict()
+            logger.info("Loaded persona %s (%s bytes, %s loaded)", slug, entry[1], len(self.loaded))
+            return persona
+
+
+    # Function to get a persona from a coroutine; a load (which may parse a PDF) runs in a worker thread
+    async def aget(self, slug = None):
+        persona = self.cached(slug or self.default)
+        if persona is not None:
+            return persona
+        return await asyncio.to_thread(self.get, slug)
+
+
+    # Function to describe the loaded personas, e.g. for a status endpoint
+    def stats(self):
+        with self.lock:
+            return {"loaded" : list(self.loaded), "memory_bytes" : self.memory, "memory_cap_bytes" : self.memory_cap}
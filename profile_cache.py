@@ -0,0 +1,108 @@
+# Import necessary libraries
+import argparse  # For the command line interface used to prebuild the cache
+import hashlib  # For hashing the source files
+import json  # For reading and writing the cache file
+import logging  # For reporting a cache that cannot be written
+import os  # For interacting with the operating system
+from retrieval import chunk_profile  # For the chunks stored alongside the extracted text
+
+
+# Logger of this module
+logger = logging.getLogger(__name__)
+
+
+# Bump whenever the extraction or chunking changes, so caches built by an older version are rebuilt
+CACHE_VERSION = 1
+
+# Name of the cache file, written next to the LinkedIn PDF
+CACHE_FILE_NAME = ".profile_cache.json"
+
+
+# Function to compute the key of a profile from the content of its source files
+def profile_hash(linkedIn_path, summary_path):
+    digest = hashlib.sha256(f"v{CACHE_VERSION}".encode())
+    for path in (linkedIn_path, summary_path):
+        with open(path, "rb") as f:
+            file_digest = hashlib.sha256(f.read()).hexdigest()  # Hash each file on its own so the boundary between them is unambiguous
+        digest.update(file_digest.encode())
+    return digest.hexdigest()
+
+
+# Function to get the cache location for a profile: next to the PDF, or in 'cache_dir' under the name of the PDF's directory
+def default_cache_path(linkedIn_path, cache_dir = None):
+    directory = os.path.dirname(os.path.abspath(linkedIn_path))
+    if not cache_dir:
+        return os.path.join(directory, CACHE_FILE_NAME)
+    return os.path.join(cache_dir, os.path.basename(directory) + CACHE_FILE_NAME)  # One file per persona, e.g. me.profile_cache.json
+
+
+# Function to extract the profile from its source files (the slow path)
+def extract_profile(linkedIn_path, summary_path):
+    from pypdf import PdfReader  # Imported here, as a warm cache never needs it
+
+    # Read the LinkedIn profile PDF file and join the text of its pages in one go
+    reader = PdfReader(linkedIn_path)
+    linkedin = "".join(text for text in (page.extract_text() for page in reader.pages) if text)
+
+    # Read the LinkedIn summary from a text file
+    with open(summary_path, "r", encoding = "utf-8") as f:
+        summary = f.read()
+
+    return {
+        "linkedin" : linkedin,  # Extracted LinkedIn text
+        "summary" : summary,  # Summary text
+        "chunks" : [chunk.to_dict() for chunk in chunk_profile(linkedin, summary)],  # Retrieval chunks
+    }
+
+
+# Function to write the cache atomically, so a concurrent reader never sees a partial file
+def write_cache(cache_path, profile):
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok = True)
+    temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding = "utf-8") as f:
+        json.dump(profile, f, ensure_ascii = False)
+    os.replace(temporary_path, cache_path)
+
+
+# Function to load a profile, from the cache when it matches the source files and by extraction otherwise
+def load_profile(linkedIn_path, summary_path, cache_path = None):
+    """
+    Returns a dictionary with the LinkedIn text, the summary and the retrieval chunks.
+    The cache is a single JSON file keyed by the hash of the PDF and summary contents: when the key matches, the
+    profile is loaded with one read and no PDF parsing; otherwise it is extracted again and the cache rewritten.
+    A cache that cannot be written (e.g. a read-only image) only costs the extraction, it never fails the load.
+    """
+    cache_path = cache_path or default_cache_path(linkedIn_path)
+    key = profile_hash(linkedIn_path, summary_path)
+
+    # Fast path: the cache exists and was built from the same files
+    try:
+        with open(cache_path, "r", encoding = "utf-8") as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return cached["profile"]
+    except (OSError, ValueError, KeyError):
+        pass  # Missing or unreadable cache, rebuild it
+
+    # Slow path: extract the profile and store it for the next start
+    profile = extract_profile(linkedIn_path, summary_path)
+    try:
+        write_cache(cache_path, {"key" : key, "profile" : profile})
+    except OSError as error:
+        logger.warning("Could not write profile cache %s -> %r", cache_path, error)
+    return profile
+
+
+# Prebuild the cache, e.g. at image build time: python profile_cache.py me/personal_linkedIn.pdf me/summary.txt
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Prebuild the extracted-profile cache so that processes start without parsing the PDF.")
+    parser.add_argument("linkedin", nargs = "?", default = "me/personal_linkedIn.pdf", help = "Path to the LinkedIn profile PDF")
+    parser.add_argument("summary", nargs = "?", default = "me/summary.txt", help = "Path to the summary text file")
+    parser.add_argument("--cache", default = None, help = f"Cache file to write (default: {CACHE_FILE_NAME} next to the PDF, or in --cache-dir)")
+    parser.add_argument("--cache-dir", default = os.getenv("PROFILE_CACHE_PATH"), help = "Directory of the per-persona cache files (default: PROFILE_CACHE_PATH)")
+    args = parser.parse_args()
+
+    cache_path = args.cache or default_cache_path(args.linkedin, args.cache_dir)
+    profile = extract_profile(args.linkedin, args.summary)
+    write_cache(cache_path, {"key" : profile_hash(args.linkedin, args.summary), "profile" : profile})
+    print(f"Wrote {cache_path} ({len(profile['linkedin'])} LinkedIn characters, {len(profile['chunks'])} chunks)")
@@ -0,0 +1,157 @@
+# Import necessary libraries
+import asyncio  # For keeping disk access off the event loop
+import hashlib  # For the cache keys
+import re  # For normalizing messages
+import sqlite3  # For the optional on-disk tier
+import threading  # For guarding the in-memory tier and the database connection
+import time  # For expiring entries
+from collections import OrderedDict  # For the LRU in-memory tier
+
+
+# Punctuation and other symbols, removed when normalizing
+punctuation_pattern = re.compile(r"[^\w\s]")
+
+# Runs of whitespace, collapsed when normalizing
+whitespace_pattern = re.compile(r"\s+")
+
+
+# Function to normalize a message so that trivial differences (case, punctuation, spacing) map to the same key
+def normalize_message(message):
+    message = punctuation_pattern.sub(" ", message.lower())
+    return whitespace_pattern.sub(" ", message).strip()
+
+
+# Function to tell whether the reply to a message can be reused regardless of the conversation it appears in
+def is_history_independent(message, history):
+    # Only first turns: later ones ("yes", "why?", "what is my name?") are answered from the conversation, whose
+    # details must never be replayed to another visitor typing the same words
+    return not history
+
+
+# Cache of replies to repeated visitor questions: an in-memory LRU with expiry, optionally backed by SQLite
+class ResponseCache:
+    """
+    Keys are the hash of the normalized message together with the profile version (a hash of the profile content), so
+    editing the profile invalidates every entry at once. Lookups try memory first, then the disk tier, promoting disk
+    hits to memory. hits / disk_hits / misses / stores / discards count what the cache did since the process started.
+    """
+
+    def __init__(self, profile_version, max_size = 512, ttl = 3600.0, disk_path = None):
+        self.profile_version = profile_version  # Hash of the profile the cached replies were generated from
+        self.max_size = max_size  # Maximum number of entries in memory
+        self.ttl = ttl  # Seconds an entry stays valid
+        self.entries = OrderedDict()  # Key -> (expiry time, reply), least recently used first
+        self.lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.discards = 0
+
+        # Optional on-disk tier, shared between processes and kept across restarts
+        self.db = None
+        if disk_path:
+            self.db = sqlite3.connect(disk_path, check_same_thread = False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, reply TEXT NOT NULL, expires REAL NOT NULL)")
+            self.db.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+            self.db.commit()
+            self.db_lock = threading.Lock()
+
+
+    # Function to compute the key of a message
+    def key(self, message):
+        return hashlib.sha256(f"{self.profile_version}\x00{normalize_message(message)}".encode("utf-8")).hexdigest()
+
+
+    # Function to get a reply from the in-memory tier, or None
+    def get_memory(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[key]  # Expired
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+
+    # Function to put a reply in the in-memory tier, evicting the least recently used entries when full
+    def put_memory(self, key, reply, expires):
+        with self.lock:
+            self.entries[key] = (expires, reply)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last = False)
+
+
+    # Function to get a reply from the disk tier, or None
+    def get_disk(self, key):
+        with self.db_lock:
+            row = self.db.execute("SELECT reply, expires FROM responses WHERE key = ? AND expires >= ?", (key, time.time())).fetchone()
+        return row
+
+
+    # Function to put a reply in the disk tier
+    def put_disk(self, key, reply, expires):
+        with self.db_lock:
+            self.db.execute("INSERT OR REPLACE INTO responses (key, reply, expires) VALUES (?, ?, ?)", (key, reply, expires))
+            self.db.commit()
+
+
+    # Function to remove a reply from the disk tier, only if it is still the one cached for the key when 'reply' is given
+    def delete_disk(self, key, reply):
+        with self.db_lock:
+            self.db.execute("DELETE FROM responses WHERE key = ? AND (? IS NULL OR reply = ?)", (key, reply, reply))
+            self.db.commit()
+
+
+    # Function to look up the cached reply to a message, or None
+    async def lookup(self, message):
+        key = self.key(message)
+        reply = self.get_memory(key)
+        if reply is not None:
+            self.hits = self.hits + 1
+            return reply
+
+        if self.db is not None:
+            row = await asyncio.to_thread(self.get_disk, key)
+            if row is not None:
+                self.disk_hits = self.disk_hits + 1
+                self.put_memory(key, row[0], row[1])  # Promote to memory, keeping the original expiry
+                return row[0]
+
+        self.misses = self.misses + 1
+        return None
+
+
+    # Function to cache the reply to a message
+    async def store(self, message, reply):
+        key = self.key(message)
+        expires = time.time() + self.ttl
+        self.put_memory(key, reply, expires)
+        if self.db is not None:
+            await asyncio.to_thread(self.put_disk, key, reply, expires)
+        self.stores = self.stores + 1
+
+
+    # Function to stop serving the cached reply to a message, e.g. once the evaluator rejected it; with 'reply', only
+    # when that is still the reply cached (another turn may have cached a better one meanwhile)
+    async def discard(self, message, reply = None):
+        key = self.key(message)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (reply is None or entry[1] == reply):
+                del self.entries[key]
+        if self.db is not None:
+            await asyncio.to_thread(self.delete_disk, key, reply)
+        self.discards = self.discards + 1
+
+
+    # Function to report the counters, e.g. for logging
+    def stats(self):
+        return {"hits" : self.hits, "disk_hits" : self.disk_hits, "misses" : self.misses, "stores" : self.stores, "discards" : self.discards,
+                "size" : len(self.entries)}
@@ -0,0 +1,177 @@
+# Import necessary libraries
+import math  # For the BM25 inverse document frequency
+import re  # For splitting text into sections and terms
+from collections import Counter  # For counting term frequencies per chunk
+from tokens import count_tokens  # For sizing chunks against the token budget
+
+
+# Headings used by the LinkedIn "Save to PDF" export; a line equal to one of these starts a new section
+linkedin_section_headings = {
+    "contact", "top skills", "languages", "certifications", "honors-awards", "publications", "patents", "summary",
+    "experience", "education", "projects", "volunteer experience", "courses", "recommendations", "organizations",
+}
+
+# Page footers added by the export, e.g. "Page 1 of 3", which carry no information
+page_footer_pattern = re.compile(r"^\s*Page \d+ of \d+\s*$")
+
+# Terms are lower-cased runs of letters and digits
+term_pattern = re.compile(r"[a-z0-9]+")
+
+# Common words that would otherwise dominate the scores of short questions
+stop_words = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "did", "do", "does", "for", "from", "has", "have", "he",
+    "his", "how", "i", "in", "is", "it", "its", "me", "my", "of", "on", "or", "she", "so", "tell", "that", "the",
+    "their", "them", "they", "this", "to", "was", "what", "when", "where", "which", "who", "why", "with", "you", "your",
+}
+
+
+# Function to split a text into the terms used for indexing and querying
+def tokenize(text):
+    return [term for term in term_pattern.findall(text.lower()) if term not in stop_words]
+
+
+# A piece of the profile that can be retrieved on its own
+class Chunk:
+    def __init__(self, source, section, text, position):
+        self.source = source  # Which document the chunk comes from ("linkedin" or "summary")
+        self.section = section  # Heading of the section the chunk belongs to
+        self.text = text  # The chunk text itself
+        self.position = position  # Order of the chunk in the profile, used to present excerpts in reading order
+        self.tokens = count_tokens(text)  # Size in tokens, used to respect the token budget
+
+
+    # Function to render the chunk with its section heading, so the model knows where it comes from
+    def render(self):
+        return f"### {self.section}\n{self.text}"
+
+
+    # Function to convert the chunk to a JSON-serializable dictionary
+    def to_dict(self):
+        return {"source" : self.source, "section" : self.section, "text" : self.text, "position" : self.position}
+
+
+    # Function to rebuild a chunk from the dictionary produced by to_dict
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["source"], data["section"], data["text"], data["position"])
+
+
+# Function to split the profile documents into section-aware chunks
+def chunk_profile(linkedin, summary, max_chunk_tokens = 200):
+    """
+    The LinkedIn text is split at its section headings (Experience, Education, ...) and each section is then cut at
+    line boundaries into chunks of at most 'max_chunk_tokens', so a chunk never straddles two sections. The summary
+    file is split into paragraphs. Every chunk remembers its section heading, which is repeated when it is rendered.
+    """
+    chunks = []  # All chunks, in reading order
+
+    # Function to cut the lines of one section into chunks that respect the size limit
+    def add_section(source, section, lines):
+        current = []  # Lines of the chunk being built
+        current_tokens = 0  # Size of the chunk being built
+        for line in lines:
+            line_tokens = count_tokens(line)
+            if current and current_tokens + line_tokens > max_chunk_tokens:
+                chunks.append(Chunk(source, section, "\n".join(current), len(chunks)))
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens = current_tokens + line_tokens
+        if current:
+            chunks.append(Chunk(source, section, "\n".join(current), len(chunks)))
+
+    # Split the LinkedIn export at its headings; whatever precedes the first heading is the profile header
+    section, lines = "Profile", []
+    for line in linkedin.splitlines():
+        if page_footer_pattern.match(line) or not line.strip():
+            continue  # Drop page footers and blank lines
+        if line.strip().lower() in linkedin_section_headings:
+            add_section("linkedin", section, lines)
+            section, lines = line.strip(), []
+        else:
+            lines.append(line.rstrip())
+    add_section("linkedin", section, lines)
+
+    # Split the summary into paragraphs (or lines, which is how the summary file is usually written)
+    paragraphs = [paragraph.strip() for paragraph in re.split(r"\n\s*\n|\n", summary) if paragraph.strip()]
+    add_section("summary", "Personal Summary", paragraphs)
+
+    return chunks
+
+
+# In-memory Okapi BM25 index over the profile chunks
+class BM25Index:
+    """
+    Term statistics are computed once when the index is built; a query then only touches the postings of its own
+    terms, which for a profile of a few hundred chunks takes well under a millisecond.
+    """
+
+    def __init__(self, chunks, k1 = 1.5, b = 0.75):
+        self.chunks = chunks
+        self.k1 = k1  # Term frequency saturation
+        self.b = b  # Length normalization
+
+        # Per-chunk term frequencies and lengths
+        term_frequencies = [Counter(tokenize(chunk.render())) for chunk in chunks]
+        self.lengths = [sum(frequencies.values()) for frequencies in term_frequencies]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+        # Postings: term -> list of (chunk index, term frequency)
+        self.postings = {}
+        for index, frequencies in enumerate(term_frequencies):
+            for term, frequency in frequencies.items():
+                self.postings.setdefault(term, []).append((index, frequency))
+
+        # Inverse document frequency of every term, precomputed
+        total = len(chunks)
+        self.idf = {term : math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5)) for term, postings in self.postings.items()}
+
+
+    # Function to score every chunk against a query, returning (score, chunk index) pairs with a positive score
+    def search(self, query):
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue  # The term does not occur in the profile
+            for index, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / self.average_length)
+                scores[index] = scores.get(index, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(((score, index) for index, score in scores.items()), reverse = True)
+
+
+# Selects the profile excerpts to send with a message
+class ProfileRetriever:
+    def __init__(self, chunks, top_k = 6, token_budget = 800):
+        self.chunks = chunks
+        self.index = BM25Index(chunks)
+        self.top_k = top_k  # Maximum number of chunks per message
+        self.token_budget = token_budget  # Maximum size in tokens of the excerpts per message
+        self.total_tokens = sum(chunk.tokens for chunk in chunks)  # Size of the whole profile
+
+
+    # Function to pick the excerpts relevant to a message, or None when the full profile should be used instead
+    def retrieve(self, query):
+        """
+        Returns the rendered excerpts, in reading order, of the best-scoring chunks that fit the token budget.
+        Returns None (meaning: fall back to the full profile) when the whole profile fits in the budget anyway, or when
+        nothing in the profile matches the message, e.g. a greeting or a question phrased without any profile terms.
+        """
+        if self.total_tokens <= self.token_budget:
+            return None
+
+        selected = []  # Chunks chosen so far
+        used_tokens = 0  # Size of the chosen chunks
+        for score, index in self.index.search(query):
+            chunk = self.chunks[index]
+            if used_tokens + chunk.tokens > self.token_budget:
+                continue  # Too big for what is left of the budget; a smaller, lower-ranked chunk may still fit
+            selected.append(chunk)
+            used_tokens = used_tokens + chunk.tokens
+            if len(selected) >= self.top_k:
+                break
+
+        if not selected:
+            return None
+
+        selected.sort(key = lambda chunk : chunk.position)
+        return "\n\n".join(chunk.render() for chunk in selected)
@@ -0,0 +1,161 @@
+# Import necessary libraries
+import argparse  # For the command line interface
+import contextlib  # For the lifespan of the application
+import json  # For the request and response bodies
+import logging  # For the application log
+import math  # For rounding up Retry-After
+import os  # For interacting with the operating system
+from starlette.applications import Starlette  # For the ASGI application
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse  # For the JSON, metrics and SSE responses
+from starlette.routing import Route  # For the routes
+from app import Me  # For answering the chats; importing app does not load gradio or openai
+from personas import PERSONA_HEADER, PersonaRegistry  # For routing each request to its persona
+from notifications import get_notification_dispatcher  # For flushing the notifications on shutdown
+from admission import get_client_rate_limiter  # For the per-client rate limit
+from metrics import configure_logging, render_metrics  # For the log settings and the metrics of this worker
+
+
+# Logger of this module
+logger = logging.getLogger(__name__)
+
+
+# Function to read and validate a chat request, returning (message, history) or raising ValueError
+async def read_chat_request(request):
+    try:
+        body = json.loads(await request.body() or b"{}")
+    except ValueError:
+        raise ValueError("Body must be JSON")
+    if not isinstance(body, dict):
+        raise ValueError("Body must be a JSON object")
+
+    message = body.get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise ValueError("'message' must be a non-empty string")
+
+    # History in the same "messages" format as the Gradio chat: [{"role" : "user" | "assistant", "content" : "..."}, ...]
+    history = body.get("history") or []
+    if not isinstance(history, list) or not all(isinstance(entry, dict) and entry.get("role") in ("user", "assistant") for entry in history):
+        raise ValueError("'history' must be a list of {'role' : 'user' | 'assistant', 'content' : ...} objects")
+    return message, history
+
+
+# Function to find the persona of a request: the X-Persona header, else the /<persona>/ prefix of the path, else the default
+async def request_persona(request):
+    registry = request.app.state.registry
+    return await registry.aget(request.headers.get(PERSONA_HEADER) or request.path_params.get("persona") or registry.default)
+
+
+# Function to apply the per-client rate limit, returning None when admitted or the 429 response to send
+def rate_limit(request):
+    rate_limiter = get_client_rate_limiter()
+    client = rate_limiter.client_key(request.client.host if request.client else None, request.headers.get("x-session-id"))
+    wait = rate_limiter.check(client)
+    if not wait:
+        return None
+    return JSONResponse({"error" : "Too many requests"}, status_code = 429, headers = {"Retry-After" : str(math.ceil(wait))})
+
+
+# Function to format one server-sent event
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii = False)}\n\n"
+
+
+# POST [/<persona>]/chat : {"message" : ..., "history" : [...]} -> {"reply" : ...}
+async def chat(request):
+    limited = rate_limit(request)
+    if limited is not None:
+        return limited
+    try:
+        message, history = await read_chat_request(request)
+        persona = await request_persona(request)
+    except ValueError as error:
+        return JSONResponse({"error" : str(error)}, status_code = 400)
+    except KeyError as error:
+        return JSONResponse({"error" : error.args[0]}, status_code = 404)
+
+    reply = ""
+    async for reply in persona.chat(message, history):
+        pass  # Each value replaces the previous one, the last is the complete reply
+    return JSONResponse({"reply" : reply})
+
+
+# POST [/<persona>]/chat/stream : same body, answered with server-sent events
+async def chat_stream(request):
+    """
+    Events: "delta" ({"text" : ...}) appends to the reply shown so far, "replace" ({"reply" : ...}) replaces it (e.g.
+    when the agent starts over after calling a tool), "done" ({"reply" : ...}) carries the complete reply and
+    "error" ({"error" : ...}) ends a turn that failed. A reply that is evaluated before it is shown arrives in one piece.
+    """
+    limited = rate_limit(request)
+    if limited is not None:
+        return limited
+    try:
+        message, history = await read_chat_request(request)
+        persona = await request_persona(request)
+    except ValueError as error:
+        return JSONResponse({"error" : str(error)}, status_code = 400)
+    except KeyError as error:
+        return JSONResponse({"error" : error.args[0]}, status_code = 404)
+
+    async def events():
+        shown = ""
+        try:
+            async for reply in persona.chat(message, history):
+                if reply.startswith(shown):
+                    if len(reply) > len(shown):
+                        yield sse_event("delta", {"text" : reply[len(shown):]})
+                else:
+                    yield sse_event("replace", {"reply" : reply})
+                shown = reply
+        except Exception as error:  # The status line is already sent, so the failure is reported as an event
+            logger.exception("Chat failed -> %r", error)
+            yield sse_event("error", {"error" : "The reply could not be completed"})
+            return
+        yield sse_event("done", {"reply" : shown})
+
+    return StreamingResponse(events(), media_type = "text/event-stream", headers = {"Cache-Control" : "no-cache", "X-Accel-Buffering" : "no"})
+
+
+# GET /healthz : liveness and the personas loaded by this worker
+async def healthz(request):
+    return JSONResponse({"status" : "ok", "personas" : request.app.state.registry.stats()})
+
+
+# GET /metrics : the metrics of this worker in the Prometheus text format
+async def metrics(request):
+    return PlainTextResponse(render_metrics(), media_type = "text/plain; version=0.0.4")
+
+
+# Function to build the ASGI application; each worker process builds its own (uvicorn calls it as a factory)
+def create_app():
+    configure_logging()
+    registry = PersonaRegistry(Me)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        await registry.aget()  # Load the default persona before the first request
+        yield
+        get_notification_dispatcher().close()  # Let the shared notification pipeline finish what it is sending
+
+    app = Starlette(routes = [
+        Route("/healthz", healthz, methods = ["GET"]),
+        Route("/metrics", metrics, methods = ["GET"]),
+        Route("/chat", chat, methods = ["POST"]),
+        Route("/chat/stream", chat_stream, methods = ["POST"]),
+        Route("/{persona}/chat", chat, methods = ["POST"]),
+        Route("/{persona}/chat/stream", chat_stream, methods = ["POST"]),
+    ], lifespan = lifespan)
+    app.state.registry = registry
+    return app
+
+
+# Serve the chat without the Gradio UI: python server.py --port 8000 --workers 4
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Headless JSON and server-sent events API for the chat.")
+    parser.add_argument("--host", default = os.getenv("SERVER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type = int, default = int(os.getenv("SERVER_PORT", "8000")))
+    parser.add_argument("--workers", type = int, default = int(os.getenv("SERVER_WORKERS", "1")), help = "Worker processes")
+    args = parser.parse_args()
+
+    import uvicorn  # Imported here, so that importing this module (e.g. by the startup benchmark) stays cheap
+    uvicorn.run("server:create_app", factory = True, host = args.host, port = args.port, workers = args.workers, log_level = "warning")
@@ -0,0 +1,7 @@
+# Import necessary libraries
+import os  # For the path of the repository root
+import sys  # For importing the modules under test
+
+
+# The modules live at the repository root, next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
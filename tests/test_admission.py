@@ -0,0 +1,115 @@
+# Import necessary libraries
+import asyncio  # For running the coroutines under test
+import httpx  # For the fake upstream responses
+import openai  # For the upstream errors
+import pytest  # For the expected exceptions
+from admission import Overloaded, UpstreamLimiter, UpstreamUnavailable, call_with_retries  # The admission control under test
+
+
+# Function to build the error the client raises on a 429, with the given response headers
+def rate_limit_error(headers):
+    response = httpx.Response(429, headers = headers, request = httpx.Request("POST", "https://api.example.com/v1/chat/completions"))
+    return openai.RateLimitError("Rate limit reached", response = response, body = None)
+
+
+# Stand-in for an upstream call failing with the given errors before it succeeds
+class FlakyCall:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.attempts = 0
+
+    async def __call__(self):
+        self.attempts = self.attempts + 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "reply"
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    delays = []
+    sleep = asyncio.sleep
+
+    async def record(delay):
+        delays.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", record)
+    return delays
+
+
+def test_retries_wait_as_long_as_the_upstream_asks(delays):
+    call = FlakyCall(rate_limit_error({"retry-after-ms" : "250"}), rate_limit_error({"retry-after" : "2"}))
+    assert asyncio.run(call_with_retries(call, max_retries = 3, base_delay = 0.01)) == "reply"
+    assert call.attempts == 3
+    assert delays == [0.25, 2.0]
+
+
+def test_the_retry_after_delay_is_capped(delays):
+    call = FlakyCall(rate_limit_error({"retry-after" : "3600"}))
+    assert asyncio.run(call_with_retries(call, max_retries = 1, max_delay = 5.0)) == "reply"
+    assert delays == [5.0]
+
+
+def test_the_last_failed_attempt_gives_up_as_unavailable(delays):
+    call = FlakyCall(*[rate_limit_error({"retry-after-ms" : "10"}) for _ in range(3)])
+    with pytest.raises(UpstreamUnavailable) as raised:
+        asyncio.run(call_with_retries(call, max_retries = 2))
+    assert call.attempts == 3
+    assert isinstance(raised.value.__cause__, openai.RateLimitError)
+
+
+def test_errors_that_are_not_retryable_are_raised_at_once(delays):
+    call = FlakyCall(ValueError("bad request"))
+    with pytest.raises(ValueError):
+        asyncio.run(call_with_retries(call, max_retries = 3))
+    assert call.attempts == 1 and delays == []
+
+
+def test_calls_beyond_the_queue_bound_are_shed():
+    limiter = UpstreamLimiter("test", limit = 1, max_waiting = 1, queue_timeout = 5.0)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0.05)  # One call in flight, one waiting
+        with pytest.raises(Overloaded):
+            async with limiter.slot():
+                pass
+        release.set()
+        await asyncio.gather(holder, waiter)  # The waiting call got the slot once it was freed
+        async with limiter.slot():
+            pass
+        assert limiter.waiting == 0
+
+    asyncio.run(main())
+
+
+def test_calls_waiting_too_long_for_a_slot_are_shed():
+    limiter = UpstreamLimiter("test", limit = 1, max_waiting = 8, queue_timeout = 0.1)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        with pytest.raises(Overloaded):
+            async with limiter.slot():
+                pass
+        assert limiter.waiting == 0
+        release.set()
+        await holder
+        async with limiter.slot():  # The slot of the shed call was not lost
+            pass
+
+    asyncio.run(main())
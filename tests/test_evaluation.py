@@ -0,0 +1,54 @@
+# Import necessary libraries
+import asyncio  # For running the coroutines under test
+import json  # For the batch input and output
+from batch_evaluation import BatchEvaluation  # The batch CLI under test
+from evaluation import EvaluationPolicy, UnreadableEvaluation  # The policy under test
+
+
+# Stand-in for Me whose evaluator cannot be read on replies containing "truncated"
+class FakePersona:
+    name = "Test Persona"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def evaluate(self, reply, message, history):
+        self.calls = self.calls + 1
+        if "truncated" in reply:
+            raise UnreadableEvaluation("EOF while parsing")
+        return {"is_acceptable" : "good" in reply, "feedback" : "" if "good" in reply else "Be specific."}
+
+
+def test_unreadable_verdicts_are_not_cached(tmp_path):
+    persona = FakePersona()
+    policy = EvaluationPolicy(mode = "blocking", store_path = str(tmp_path / "evaluations.jsonl"))
+    for _ in range(2):
+        try:
+            asyncio.run(policy.evaluate(persona.evaluate, "truncated reply", "Hello?", []))
+        except UnreadableEvaluation:
+            pass
+    assert persona.calls == 2  # Evaluated again, not served from the cache
+
+    verdict, cached = asyncio.run(policy.evaluate(persona.evaluate, "good reply", "Hello?", []))
+    assert verdict["is_acceptable"] and not cached
+    assert asyncio.run(policy.evaluate(persona.evaluate, "good reply", "Hello?", [])) == (verdict, True)
+
+
+def test_batch_counts_unreadable_verdicts_as_failed(tmp_path):
+    records = [{"message" : "Hello?", "reply" : reply} for reply in ("good reply", "bad reply", "truncated reply", "truncated reply")]
+    (tmp_path / "input.jsonl").write_text("".join(json.dumps(record) + "\n" for record in records), encoding = "utf-8")
+
+    async def run():
+        batch = BatchEvaluation(FakePersona(), str(tmp_path / "output.jsonl"), str(tmp_path / "checkpoint"))
+        try:
+            await batch.run(str(tmp_path / "input.jsonl"))
+        finally:
+            batch.close()
+
+    asyncio.run(run())
+    lines = [json.loads(line) for line in (tmp_path / "output.jsonl").read_text(encoding = "utf-8").splitlines()]
+    summary = lines[-1]
+    assert summary["type"] == "summary"
+    assert (summary["accepted"], summary["rejected"], summary["failed"]) == (1, 1, 2)
+    assert summary["acceptance_rate"] == 0.5
+    assert all("error" in line for line in lines[2:4])
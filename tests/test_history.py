@@ -0,0 +1,66 @@
+# Import necessary libraries
+import asyncio  # For running the coroutines under test
+from history import HistoryManager  # The history compaction under test
+from tokens import count_message_tokens  # For checking the sizes the test relies on
+
+
+# Function to build a fake summarizer recording what it was asked to fold
+def recording_summarizer(calls):
+    async def summarize(previous, messages):
+        calls.append((previous, messages))
+        return f"summary of {len(messages)} messages"
+    return summarize
+
+
+# Function to build an assistant message of about 'tokens' tokens
+def reply_of(tokens):
+    reply = {"role" : "assistant", "content" : "detail"}
+    while count_message_tokens(reply) < tokens:
+        reply["content"] = reply["content"] + " detail"
+    return reply
+
+
+# Function to build a history of three earlier turns followed by one turn of about 'last_tokens' tokens
+def history_with_last_turn(last_tokens, earlier_tokens = 300):
+    history = []
+    for index in range(3):
+        history.append({"role" : "user", "content" : f"Question number {index}?"})
+        history.append(reply_of(earlier_tokens))
+    history.append({"role" : "user", "content" : "Tell me everything about your last project."})
+    history.append(reply_of(last_tokens))
+    return history
+
+
+def test_history_within_budget_is_sent_verbatim():
+    calls = []
+    manager = HistoryManager(recording_summarizer(calls), token_budget = 2000)
+    history = history_with_last_turn(10, earlier_tokens = 10)
+    summary, recent = asyncio.run(manager.compact(history))
+    assert summary is None
+    assert recent == history
+    assert calls == []
+
+
+def test_last_turn_bigger_than_half_the_budget_is_kept_verbatim():
+    calls = []
+    manager = HistoryManager(recording_summarizer(calls), token_budget = 2000)
+    history = history_with_last_turn(1200)
+    last_turn = history[-2:]
+    assert 1000 < sum(count_message_tokens(message) for message in last_turn) <= 2000  # Over half the budget, within it
+    assert sum(count_message_tokens(message) for message in history) > 2000  # So the history has to be folded
+
+    summary, recent = asyncio.run(manager.compact(history))
+    assert summary is not None
+    assert recent[-2:] == last_turn
+    assert len(calls) == 1 and calls[0][1] == history[:len(history) - len(recent)]
+
+
+def test_cached_summary_never_swallows_the_last_turn():
+    calls = []
+    manager = HistoryManager(recording_summarizer(calls), token_budget = 2000)
+    history = history_with_last_turn(1200)
+    asyncio.run(manager.compact(history))
+    manager.cache_summary(manager.prefix_hashes(history)[len(history)], "summary of everything")
+
+    summary, recent = asyncio.run(manager.compact(history))
+    assert recent[-2:] == history[-2:]
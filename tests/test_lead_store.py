@@ -0,0 +1,83 @@
+# Import necessary libraries
+import pytest  # For the store fixture
+from lead_store import LeadStore, query  # The store under test
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LeadStore(path = str(tmp_path / "leads.sqlite3"), flush_interval = 0.05, thresholds = {1, 10})
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize("first, repeat", [
+    ("What's your favourite movie?", "What is your favourite movie?"),
+    ("What is your favourite movie?", "what is your FAVOURITE movie"),
+    ("Do you have experience with Kubernetes?", "Do you have any experience with Kubernetes?"),
+    ("Where did you grow up?", "Where did you grow up exactly?"),
+    ("I can't find your GitHub profile", "I cannot find your GitHub profile"),
+])
+def test_repeated_questions_share_one_row(store, first, repeat):
+    assert store.record_question("me", first) == 1
+    assert store.record_question("me", repeat) == 2
+
+
+@pytest.mark.parametrize("first, other", [
+    ("What is your favourite movie?", "What is your favourite book?"),
+    ("Do you have experience with Kubernetes?", "Do you have experience with Terraform?"),
+    ("What is your salary?", "What is your salary expectation for a senior role?"),
+])
+def test_different_questions_get_their_own_rows(store, first, other):
+    assert store.record_question("me", first) == 1
+    assert store.record_question("me", other) == 1
+
+
+def test_questions_are_counted_per_persona(store):
+    assert store.record_question("me", "What is your favourite movie?") == 1
+    assert store.record_question("other", "What is your favourite movie?") == 1
+
+
+def test_repeats_are_merged_in_the_database_and_keep_their_first_wording(store, tmp_path):
+    for question in ("What's your favourite movie?", "What is your favourite movie?", "what is your favourite movie"):
+        store.record_question("me", question)
+    store.close()
+
+    columns, rows = query(str(tmp_path / "leads.sqlite3"), "questions")
+    records = [dict(zip(columns, row)) for row in rows]
+    assert len(records) == 1
+    assert records[0]["count"] == 3
+    assert records[0]["question"] == "What's your favourite movie?"
+
+    reopened = LeadStore(path = str(tmp_path / "leads.sqlite3"), flush_interval = 0.05)
+    try:
+        assert reopened.record_question("me", "What is your favorite movie?") == 1  # A different term, still its own question
+        assert reopened.record_question("me", "what's your favourite movie") == 4  # The index is rebuilt from the file
+    finally:
+        reopened.close()
+
+
+def test_leads_are_deduplicated_by_contact(store):
+    assert store.record_lead("me", email = "Jane@Example.com", name = "Jane") == 1
+    assert store.record_lead("me", email = "jane@example.com ", notes = "Wants a call") == 2
+    assert store.record_lead("me", name = "Jane", mobile_no = "+1 555 0100") == 1  # No email, keyed by the mobile number
+    assert store.should_notify(1) and not store.should_notify(2) and store.should_notify(10)
+
+
+def test_workers_sharing_the_file_agree_on_the_counts(store, tmp_path):
+    other = LeadStore(path = str(tmp_path / "leads.sqlite3"), flush_interval = 0.05, thresholds = {1, 10})
+    try:
+        counts = [store.record_question("me", "What is your favourite movie?")]
+        counts.append(other.record_question("me", "What's your favourite movie?"))
+        counts.append(other.record_question("me", "What is your favourite movie exactly?"))  # Fuzzy match on a row the other worker added
+        counts.append(store.record_question("me", "what is your favourite movie"))
+        assert counts == [1, 2, 3, 4]  # One first occurrence, so one notification
+
+        assert store.record_lead("me", email = "jane@example.com", name = "Jane") == 1
+        assert other.record_lead("me", email = "Jane@Example.com", mobile_no = "+1 555 0100") == 2
+    finally:
+        other.close()
+    store.close()
+
+    columns, rows = query(str(tmp_path / "leads.sqlite3"), "leads")
+    records = [dict(zip(columns, row)) for row in rows]
+    assert [(record["count"], record["name"], record["mobile_no"]) for record in records] == [(2, "Jane", "+1 555 0100")]
@@ -0,0 +1,101 @@
+# Import necessary libraries
+import json  # For spooling events by hand
+import os  # For inspecting the spool
+import pytest  # For the cases of orphaned spools
+import sys  # For importing the fake Pushover server
+import time  # For waiting on deliveries
+import notifications  # For the process-wide dispatcher
+from notifications import NotificationDispatcher  # The dispatcher under test
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from fake_pushover import FakePushoverState, serve_fake_pushover  # For counting the pushes
+
+
+# Function to build a dispatcher posting to a fake Pushover server
+def dispatcher(spool_dir, port, digest_window = 0.5, **settings):
+    return NotificationDispatcher(url = f"http://127.0.0.1:{port}/1/messages.json", user = "test", token = "test",
+                                  spool_dir = spool_dir, digest_window = digest_window, **settings)
+
+
+# Function to wait until a condition holds, or fail after 'timeout' seconds
+def wait_for(condition, timeout = 10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.05)
+
+
+def test_workers_sharing_a_spool_send_each_event_once(tmp_path):
+    server, state = serve_fake_pushover(state = FakePushoverState(latency = 0.0))
+    try:
+        first = dispatcher(str(tmp_path), server.server_port, digest_window = 1.0)
+        second = dispatcher(str(tmp_path), server.server_port)
+        first.notify("What is your favourite movie?", kind = "unknown_question")  # Held in the digest window
+        first.notify("Lead: jane@example.com")
+        second.start()  # Started while the first still holds its events
+        second.requeue_spool()  # As after a queue overflow
+        wait_for(lambda: state.received >= 2)
+        time.sleep(0.5)
+        first.close()
+        second.close()
+        assert state.received == 2
+    finally:
+        server.shutdown()
+
+
+@pytest.mark.parametrize("pid", [999999999, os.getpid()])  # No such process, or ours reused after a restart
+def test_events_of_a_stopped_process_are_claimed_once(tmp_path, pid):
+    server, state = serve_fake_pushover(state = FakePushoverState(latency = 0.0))
+    try:
+        orphaned = tmp_path / f"worker-{pid}-deadbeef"
+        orphaned.mkdir()
+        event = {"id" : "1-orphan", "kind" : "message", "message" : "Left behind", "created" : time.time()}
+        (orphaned / "1-orphan.json").write_text(json.dumps(event), encoding = "utf-8")
+
+        first = dispatcher(str(tmp_path), server.server_port).start()
+        second = dispatcher(str(tmp_path), server.server_port).start()
+        wait_for(lambda: state.received >= 1)
+        time.sleep(0.5)
+        first.close()
+        second.close()
+        assert state.received == 1
+        assert not orphaned.exists()
+        assert os.listdir(tmp_path) == []  # Everything delivered, every subdirectory removed
+    finally:
+        server.shutdown()
+
+
+def test_events_are_sent_once_the_endpoint_is_back(tmp_path):
+    server, state = serve_fake_pushover(state = FakePushoverState(latency = 0.0, failure_rate = 1.0))
+    try:
+        notifier = dispatcher(str(tmp_path), server.server_port, digest_window = 0.1, max_attempts = 2, rescan_delay = 0.5)
+        notifier.notify("Lead: jane@example.com")
+        notifier.notify("What is your favourite movie?", kind = "unknown_question")
+        wait_for(lambda: state.failed >= 4)  # Both deliveries gave up
+        state.failure_rate = 0.0  # The endpoint is back
+        wait_for(lambda: state.received >= 2)
+        time.sleep(0.5)
+        notifier.close()
+        assert state.received == 2
+        assert not any(name.endswith(".json") for _, _, names in os.walk(tmp_path) for name in names)
+    finally:
+        server.shutdown()
+
+
+def test_the_shared_dispatcher_sends_what_was_left_in_the_spool_on_start(tmp_path, monkeypatch):
+    server, state = serve_fake_pushover(state = FakePushoverState(latency = 0.0))
+    try:
+        left_behind = tmp_path / "worker-999999999-deadbeef"
+        left_behind.mkdir()
+        event = {"id" : "1-left", "kind" : "message", "message" : "Left behind", "created" : time.time()}
+        (left_behind / "1-left.json").write_text(json.dumps(event), encoding = "utf-8")
+
+        monkeypatch.setenv("PUSHOVER_URL", f"http://127.0.0.1:{server.server_port}/1/messages.json")
+        monkeypatch.setenv("NOTIFY_SPOOL_DIR", str(tmp_path))
+        monkeypatch.setattr(notifications, "_dispatcher", None)
+        notifier = notifications.get_notification_dispatcher()  # No notification is sent through it
+        wait_for(lambda: state.received >= 1)
+        notifier.close()
+        assert state.received == 1
+    finally:
+        server.shutdown()
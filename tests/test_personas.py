@@ -0,0 +1,61 @@
+# Import necessary libraries
+import os  # For the path of the example persona
+import shutil  # For copying the example persona
+import profile_cache  # The per-persona profile cache under test
+from personas import LINKEDIN_FILE_NAME, SUMMARY_FILE_NAME, PersonaRegistry  # The registry under test
+
+
+# The example persona shipped with the project
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "me")
+
+
+# Stand-in for Me whose estimated size the test sets, as if its caches grew
+class FakePersona:
+    def __init__(self, name, linkedIn_path, summary_path):
+        self.name = name
+        self.size = 100
+
+    def memory_estimate(self):
+        return self.size
+
+
+# Function to create persona directories shaped like me/
+def make_personas(root, *slugs):
+    for slug in slugs:
+        directory = root / slug
+        directory.mkdir()
+        shutil.copy(os.path.join(EXAMPLE, LINKEDIN_FILE_NAME), directory / LINKEDIN_FILE_NAME)
+        shutil.copy(os.path.join(EXAMPLE, SUMMARY_FILE_NAME), directory / SUMMARY_FILE_NAME)
+
+
+def test_growth_after_loading_counts_against_the_cap(tmp_path):
+    make_personas(tmp_path, "alice", "bob", "carol")
+    registry = PersonaRegistry(FakePersona, root = str(tmp_path), memory_cap = 1000, measure_interval = 0.0)
+
+    alice = registry.get("alice")
+    registry.get("bob")
+    assert registry.stats()["memory_bytes"] == 200
+
+    alice.size = 950  # Its caches filled up while serving chats
+    assert registry.get("alice") is alice  # Used: measured again, and bob no longer fits next to it
+    assert registry.stats()["loaded"] == ["alice"]
+    assert registry.stats()["memory_bytes"] == 950
+
+    registry.get("carol")  # Loading measures alice again and evicts her, carol was just loaded
+    assert registry.stats()["loaded"] == ["carol"]
+
+
+def test_personas_sharing_a_cache_directory_keep_their_own_cache(tmp_path, monkeypatch):
+    make_personas(tmp_path, "alice", "bob")
+    extractions = []
+    extract_profile = profile_cache.extract_profile
+    monkeypatch.setattr(profile_cache, "extract_profile", lambda *paths: extractions.append(paths) or extract_profile(*paths))
+
+    cache_dir = str(tmp_path / "cache")
+    for _ in range(2):
+        for slug in ("alice", "bob"):
+            linkedIn_path = str(tmp_path / slug / LINKEDIN_FILE_NAME)
+            profile_cache.load_profile(linkedIn_path, str(tmp_path / slug / SUMMARY_FILE_NAME),
+                                       cache_path = profile_cache.default_cache_path(linkedIn_path, cache_dir))
+    assert len(extractions) == 2  # Once per persona, the second round is served from the cache
+    assert sorted(p.name for p in (tmp_path / "cache").iterdir()) == ["alice.profile_cache.json", "bob.profile_cache.json"]
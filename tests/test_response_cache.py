@@ -0,0 +1,43 @@
+# Import necessary libraries
+import asyncio  # For running the coroutines under test
+from app import Me  # For the background evaluation of a cached reply
+from evaluation import EvaluationPolicy  # The policy the background evaluation goes through
+from response_cache import ResponseCache  # The cache under test
+
+
+def test_discard_removes_the_reply_from_both_tiers(tmp_path):
+    cache = ResponseCache("v1", disk_path = str(tmp_path / "responses.db"))
+    asyncio.run(cache.store("What do you do?", "bad reply"))
+    asyncio.run(cache.discard("What do you do?", "bad reply"))
+    assert asyncio.run(cache.lookup("What do you do?")) is None
+
+    restarted = ResponseCache("v1", disk_path = str(tmp_path / "responses.db"))
+    assert asyncio.run(restarted.lookup("What do you do?")) is None
+
+
+def test_discard_keeps_a_reply_cached_meanwhile(tmp_path):
+    cache = ResponseCache("v1", disk_path = str(tmp_path / "responses.db"))
+    asyncio.run(cache.store("What do you do?", "good reply"))
+    asyncio.run(cache.discard("What do you do?", "bad reply"))  # Another turn replaced the rejected reply already
+    assert asyncio.run(cache.lookup("What do you do?")) == "good reply"
+
+    restarted = ResponseCache("v1", disk_path = str(tmp_path / "responses.db"))
+    assert asyncio.run(restarted.lookup("What do you do?")) == "good reply"
+
+
+def test_a_reply_rejected_in_the_background_is_no_longer_served(tmp_path):
+    async def evaluate(reply, message, history):
+        return {"is_acceptable" : "good" in reply, "feedback" : "" if "good" in reply else "Be specific."}
+
+    me = Me.__new__(Me)  # Only what the background evaluation uses, no client or profile
+    me.evaluate = evaluate
+    me.evaluation_policy = EvaluationPolicy(mode = "async", store_path = str(tmp_path / "evaluations.jsonl"))
+    me.response_cache = ResponseCache("v1")
+
+    async def turn(reply):
+        await me.response_cache.store("What do you do?", reply)
+        await me.evaluate_in_background(reply, "What do you do?", [], cached = True)
+        return await me.response_cache.lookup("What do you do?")
+
+    assert asyncio.run(turn("good reply")) == "good reply"
+    assert asyncio.run(turn("bad reply")) is None
@@ -0,0 +1,81 @@
+# Import necessary libraries
+import asyncio  # For running the coroutines under test
+import time  # For checking the deadline
+from types import SimpleNamespace  # For the fake completions
+from app import Me  # The speculative evaluation under test
+from evaluation import EvaluationPolicy  # For the candidates and the deadline
+
+
+# Stand-in for Me whose candidates and verdicts are scripted: reply -> (seconds to evaluate, acceptable)
+class FakeUpstream:
+    def __init__(self, verdicts, alternatives, generation_delay = 0.0, generation_error = None):
+        self.verdicts = verdicts
+        self.alternatives = alternatives
+        self.generation_delay = generation_delay
+        self.generation_error = generation_error
+        self.cancelled = []  # Replies whose evaluation was cancelled
+
+    async def evaluate(self, reply, message, history):
+        delay, acceptable = self.verdicts[reply]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(reply)
+            raise
+        return {"is_acceptable" : acceptable, "feedback" : "" if acceptable else "Be specific."}
+
+    async def create_completion(self, name, budget, **kwargs):
+        assert kwargs["n"] == len(self.alternatives) and kwargs["tool_choice"] == "none"
+        await asyncio.sleep(self.generation_delay)
+        if self.generation_error is not None:
+            raise self.generation_error
+        return SimpleNamespace(choices = [SimpleNamespace(message = SimpleNamespace(content = content)) for content in self.alternatives])
+
+
+# Function to race the first reply against the scripted alternatives, returning (reply, accepted, seconds taken)
+def speculate(tmp_path, upstream, deadline = 5.0):
+    me = Me.__new__(Me)  # Only what the speculation uses, no client or profile
+    me.evaluate = upstream.evaluate
+    me.create_completion = upstream.create_completion
+    me.evaluation_policy = EvaluationPolicy(mode = "speculative", candidates = len(upstream.alternatives) + 1, deadline = deadline,
+                                            store_path = str(tmp_path / "evaluations.jsonl"))
+
+    async def main():
+        start = time.perf_counter()
+        reply, accepted = await me.speculate("first", "What do you do?", [], [])
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(0.01)  # Let the cancelled evaluations unwind
+        return reply, accepted, elapsed
+
+    return asyncio.run(main())
+
+
+def test_the_first_acceptable_candidate_wins_and_the_others_are_cancelled(tmp_path):
+    upstream = FakeUpstream({"first" : (0.05, False), "second" : (0.05, True), "third" : (5.0, True)}, ["second", "third"])
+    reply, accepted, elapsed = speculate(tmp_path, upstream)
+    assert (reply, accepted) == ("second", True)
+    assert elapsed < 1.0
+    assert upstream.cancelled == ["third"]
+
+
+def test_the_deadline_returns_a_candidate_not_known_to_be_rejected(tmp_path):
+    upstream = FakeUpstream({"first" : (0.05, False), "second" : (5.0, True), "third" : (5.0, True)}, ["second", "third"])
+    reply, accepted, elapsed = speculate(tmp_path, upstream, deadline = 0.3)
+    assert (reply, accepted) == ("second", False)  # Still being evaluated, unlike the rejected first reply
+    assert 0.3 <= elapsed < 1.0
+    assert sorted(upstream.cancelled) == ["second", "third"]
+
+
+def test_the_first_reply_is_the_fallback_when_every_candidate_is_rejected(tmp_path):
+    upstream = FakeUpstream({"first" : (0.05, False), "second" : (0.01, False), "third" : (0.02, False)}, ["second", "third"])
+    assert speculate(tmp_path, upstream)[:2] == ("first", False)
+
+
+def test_a_failed_generation_leaves_the_first_reply_in_the_race(tmp_path):
+    upstream = FakeUpstream({"first" : (0.1, True)}, ["second", "third"], generation_error = RuntimeError("upstream down"))
+    assert speculate(tmp_path, upstream)[:2] == ("first", True)
+
+    upstream = FakeUpstream({"first" : (5.0, True)}, ["second", "third"], generation_delay = 5.0)
+    reply, accepted, elapsed = speculate(tmp_path, upstream, deadline = 0.2)
+    assert (reply, accepted) == ("first", False) and elapsed < 1.0
+    assert upstream.cancelled == ["first"]
@@ -0,0 +1,46 @@
+# Import necessary libraries
+import logging  # For reporting a missing tokenizer
+import os  # For interacting with the operating system
+import threading  # For loading the tokenizer once
+
+
+# Logger of this module
+logger = logging.getLogger(__name__)
+
+
+# Tokenizer of the chat model; TOKENIZER_ENCODING selects another tiktoken encoding
+ENCODING_NAME = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+
+# Tokens the API adds around every message for its role and separators
+MESSAGE_OVERHEAD = 4
+
+_encoding = None  # The loaded tiktoken encoding, or False when it is unavailable
+_encoding_lock = threading.Lock()
+
+
+# Function to load the tiktoken encoding once, returning None when tiktoken is missing or cannot load it
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken  # Optional dependency
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception as error:  # Not installed, or the encoding file could not be downloaded
+                    logger.warning("Tokenizer unavailable, estimating token counts instead -> %r", error)
+                    _encoding = False
+    return _encoding or None
+
+
+# Function to count the tokens of a text with the model's tokenizer (or roughly four characters per token without it)
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special = ()))
+
+
+# Function to count the tokens a chat message costs in a request
+def count_message_tokens(message):
+    return count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD
@@ -0,0 +1,129 @@
+# Import necessary libraries
+import asyncio  # For running the tool calls of one message concurrently
+import json  # For parsing the tool arguments and serializing the results
+import logging  # For reporting tool calls and their failures
+import os  # For interacting with the operating system
+
+
+# Logger of this module
+logger = logging.getLogger(__name__)
+
+
+# Python types accepted for each JSON schema type
+json_schema_types = {
+    "string" : str,
+    "integer" : int,
+    "number" : (int, float),
+    "boolean" : bool,
+    "object" : dict,
+    "array" : list,
+}
+
+
+# One registered tool: its schema for the LLM and everything needed to validate a call, computed once
+class ToolSpec:
+    def __init__(self, schema, method_name, timeout):
+        self.name = schema["name"]  # Name the LLM calls the tool by
+        self.method_name = method_name  # Name of the method implementing it on the owner object
+        self.timeout = timeout  # Seconds a call may take before its result is replaced by an error
+        self.definition = {"type" : "function", "function" : schema}  # Entry of the 'tools' list sent to the LLM
+
+        parameters = schema.get("parameters", {})
+        self.properties = parameters.get("properties", {})  # Declared parameters
+        self.required = list(parameters.get("required", []))  # Parameters the call must provide
+        self.allow_extra = parameters.get("additionalProperties", True)  # Whether undeclared parameters are accepted
+        self.defaults = {name : spec["default"] for name, spec in self.properties.items() if "default" in spec}  # Filled in when omitted
+
+
+    # Function to validate the arguments of a call, returning (arguments with defaults, error message or None)
+    def validate(self, arguments):
+        if not isinstance(arguments, dict):
+            return None, "Arguments must be a JSON object"
+
+        missing = [name for name in self.required if name not in arguments]
+        if missing:
+            return None, f"Missing parameters : {missing}"
+
+        if not self.allow_extra:
+            unexpected = [name for name in arguments if name not in self.properties]
+            if unexpected:
+                return None, f"Unexpected parameters : {unexpected}"
+
+        for name, value in arguments.items():
+            expected = json_schema_types.get(self.properties.get(name, {}).get("type"))
+            if expected is not None and not isinstance(value, expected):
+                return None, f"Parameter '{name}' must be of type {self.properties[name]['type']}"
+
+        return {**self.defaults, **arguments}, None
+
+
+# Declarative list of the tools offered to the LLM
+class ToolRegistry:
+    """
+    Tools are registered once at import time from their JSON schema; the 'tools' list for the API and the argument
+    validators are derived from the schemas there and then, instead of introspecting the implementing function on
+    every call. execute() runs all tool calls of one assistant message concurrently, each with its own timeout, and
+    returns the tool messages in the order of the calls, which is the order the API expects them in.
+    """
+
+    def __init__(self, default_timeout = None):
+        self.default_timeout = float(default_timeout if default_timeout is not None else os.getenv("TOOL_TIMEOUT", "10"))
+        self.specs = {}  # Tool name -> ToolSpec
+        self.definitions = []  # The 'tools' list sent to the LLM
+
+
+    # Function to register a tool from its JSON schema and the name of the method implementing it
+    def register(self, schema, method_name = None, timeout = None):
+        spec = ToolSpec(schema, method_name or schema["name"], timeout if timeout is not None else self.default_timeout)
+        self.specs[spec.name] = spec
+        self.definitions.append(spec.definition)
+        return spec
+
+
+    # Function to resolve the implementing methods on an object once, e.g. when it is created
+    def bind(self, owner):
+        return {name : getattr(owner, spec.method_name) for name, spec in self.specs.items()}
+
+
+    # Function to run one tool call and return its result (a JSON-serializable dictionary)
+    async def run_one(self, handlers, tool_call):
+        tool_name = tool_call["function"]["name"]
+        spec = self.specs.get(tool_name)
+        if spec is None:
+            return {"error" : f"Function '{tool_name}' not found."}
+
+        try:
+            arguments = json.loads(tool_call["function"]["arguments"] or "{}")
+        except ValueError:
+            return {"error" : "Arguments are not valid JSON"}
+
+        arguments, error = spec.validate(arguments)
+        if error is not None:
+            logger.warning("Invalid call to %s : %s", tool_name, error)
+            return {"error" : error}
+
+        logger.debug("Tool called : %s || , arguments passed : %s", tool_name, arguments)
+        try:
+            # The tools are synchronous, so each runs in a worker thread; the timeout stops the wait, not the thread
+            return await asyncio.wait_for(asyncio.to_thread(handlers[tool_name], **arguments), spec.timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Tool %s timed out after %ss", tool_name, spec.timeout)
+            return {"error" : f"Function '{tool_name}' timed out."}
+        except Exception as error:
+            logger.exception("Tool %s failed -> %r", tool_name, error)
+            return {"error" : f"Function '{tool_name}' failed."}
+
+
+    # Function to run all tool calls of one assistant message concurrently
+    async def execute(self, handlers, tool_calls):
+        results = await asyncio.gather(*(self.run_one(handlers, tool_call) for tool_call in tool_calls))
+
+        # Each entry includes the role, the content of the result, and the ID of the tool call, in the order of the calls
+        return [
+            {
+                "role" : "tool",  # Indicates that this entry is a tool result
+                "content" : json.dumps(result),  # Convert the result to a JSON string for consistency
+                "tool_call_id" : tool_call["id"]  # Include the unique ID of the tool call for reference
+            }
+            for tool_call, result in zip(tool_calls, results)
+        ]